@@ -0,0 +1,232 @@
+"""Synthetic source records, shaped like our real indexes.
+
+Each shape is based on one of the field lists in field_lists/, which have the
+number of records each field occurs in. Synthetic records have each field with
+the same probability as the real ones (its count relative to the most common
+field's), with values of the type the field's name implies: Solr dynamic field
+suffixes (title_tesim is a list of text, ark_ssi a string), Drupal Search API
+prefixes for Frontera (is_status is an integer) and so on. The profile's
+ID_FIELDS are always present, with unique values, so records can be mapped
+and copied like real ones.
+"""
+
+import ast
+import random
+from importlib import import_module
+from pathlib import Path
+
+FIELD_LISTS = Path(__file__).resolve().parent.parent / "field_lists"
+
+# Shape name: (field list, profile, source type)
+SHAPES = {
+    "ursus": ("ursus_fields.txt", "config.samvera", "solr"),
+    "sinai": ("sinai_manuscripts_fields.txt", "config.sinai", "solr"),
+    "oral_history": ("oral_history_fields.txt", "config.oralhistory", "solr"),
+    "prl": ("prl_fields.txt", "config.PRL", "solr"),
+    "sheet_music": ("sheetmusic_fields.txt", "config.sheet_music", "solr"),
+    "frontera": ("frontera_fields.txt", "config.frontera", "frontera"),
+    "dataverse": ("dataverse_fields.txt", "config.dataverse", "dataverse"),
+}
+
+# Fields whose names don't say what type they are.
+FIELD_KINDS = {
+    # Solr
+    "_version_": "int",
+    "timestamp": "date",
+    # Frontera; content is the full text of a page, and by far the largest field.
+    "content": "content",
+    "item_id": "string",
+    "index_id": "string",
+    "spell": "texts",
+    # Sheet music
+    "collectionKey": "strings",
+    "fileLastModified": "date",
+    "fileSize": "int",
+    "names": "strings",
+    "places": "strings",
+    "publishers": "strings",
+    # Dataverse search API
+    "authors": "strings",
+    "contacts": "strings",
+    "createdAt": "date",
+    "dataSources": "strings",
+    "description": "text",
+    "fileCount": "int",
+    "file_id": "int",
+    "geographicCoverage": "strings",
+    "keywords": "strings",
+    "majorVersion": "int",
+    "minorVersion": "int",
+    "producers": "strings",
+    "publications": "strings",
+    "published_at": "date",
+    "relatedMaterial": "strings",
+    "size_in_bytes": "int",
+    "subjects": "strings",
+    "updatedAt": "date",
+    "versionId": "int",
+}
+
+# (suffix, kind), checked in order, so longer suffixes come first.
+SUFFIX_KINDS = (
+    ("_tesim", "texts"),
+    ("_teim", "texts"),
+    ("_tim", "texts"),
+    ("_mt", "texts"),
+    ("_dtsim", "dates"),
+    ("_mdt", "dates"),
+    ("_ssim", "strings"),
+    ("_isim", "ints"),
+    ("_sim", "strings"),
+    ("_ssm", "strings"),
+    ("_ms", "strings"),
+    ("_keyword", "strings"),
+    ("_facet", "strings"),
+    ("_dtsort", "date"),
+    ("_dtsi", "date"),
+    ("_dt", "date"),
+    ("_isi", "int"),
+    ("_lts", "int"),
+    ("_bsi", "bool"),
+    ("_tesi", "text"),
+    ("_tsi", "text"),
+    ("_t", "text"),
+)
+
+# Drupal Search API field prefixes, as used by Frontera.
+PREFIX_KINDS = (
+    ("tm_", "texts"),
+    ("sm_", "strings"),
+    ("im_", "ints"),
+    ("dm_", "dates"),
+    ("ts_", "text"),
+    ("ss_", "string"),
+    ("is_", "int"),
+    ("ds_", "date"),
+    ("bs_", "bool"),
+)
+
+# Fields Solr adds to results which aren't stored in records.
+SKIP_FIELDS = frozenset({"score"})
+
+# Unique values of ID fields, by record number.
+ID_FORMATS = {
+    "ark_ssi": "ark:/21198/z{:08d}",
+    "url": "https://dataverse.library.ucla.edu/dataset.xhtml?id={:08d}",
+}
+
+WORDS = (
+    "los angeles california library manuscript collection photograph map "
+    "letter music recording sheet oral history interview archive sinai "
+    "palimpsest greek syriac arabic armenian georgian latin coptic ethiopic "
+    "parchment paper folio codex gospel psalter liturgy homily hymn chant "
+    "portrait street building campus student faculty newspaper journal "
+    "survey census election protest theater film television radio jazz "
+    "blues folk song artist composer performer label record album side "
+    "track catalog edition publisher printer engraver illustration cover "
+    "west east north south river mountain desert ocean harbor city county"
+).split()
+
+
+def load_field_counts(field_list: str) -> dict[str, int]:
+    """Read a field list: a dict of field name to number of records,
+    as written by get_fields (pprint) or by hand (JSON)."""
+    return ast.literal_eval((FIELD_LISTS / field_list).read_text().strip())
+
+
+def field_kind(field: str) -> str:
+    """Get the type of a field's values, from its name."""
+    if field in FIELD_KINDS:
+        return FIELD_KINDS[field]
+    for suffix, kind in SUFFIX_KINDS:
+        if field.endswith(suffix):
+            return kind
+    for prefix, kind in PREFIX_KINDS:
+        if field.startswith(prefix):
+            return kind
+    return "string"
+
+
+class CorpusGenerator:
+    """Makes synthetic records of one shape. Records are the same for the same
+    seed, so benchmark runs are comparable."""
+
+    def __init__(self, shape: str, seed: int = 0):
+        field_list, profile, _ = SHAPES[shape]
+        self.shape = shape
+        self.id_fields = getattr(import_module(profile), "ID_FIELDS", ["id"])
+        counts = load_field_counts(field_list)
+        most = max(counts.values())
+        # (field, kind, probability), with ID fields always present.
+        self.fields = [
+            (
+                field,
+                field_kind(field),
+                1.0 if field in self.id_fields else count / most,
+            )
+            for field, count in sorted(counts.items())
+            if field not in SKIP_FIELDS
+        ]
+        self.fields.extend(
+            (field, field_kind(field), 1.0)
+            for field in self.id_fields
+            if field not in counts
+        )
+        self.random = random.Random(seed)
+
+    def _words(self, low: int, high: int) -> str:
+        return " ".join(self.random.choices(WORDS, k=self.random.randint(low, high)))
+
+    def _date(self) -> str:
+        r = self.random
+        return (
+            f"{r.randint(1990, 2024)}-{r.randint(1, 12):02d}-{r.randint(1, 28):02d}"
+            f"T{r.randint(0, 23):02d}:{r.randint(0, 59):02d}:00Z"
+        )
+
+    def _value(self, kind: str):
+        r = self.random
+        if kind == "string":
+            return self._words(1, 4)
+        if kind == "text":
+            return self._words(5, 40)
+        if kind == "content":
+            return self._words(200, 800)
+        if kind == "int":
+            return r.randint(0, 100_000)
+        if kind == "bool":
+            return r.random() < 0.5
+        if kind == "date":
+            return self._date()
+        values = r.randint(1, 4)
+        if kind == "strings":
+            return [self._words(1, 4) for _ in range(values)]
+        if kind == "texts":
+            return [self._words(5, 30) for _ in range(values)]
+        if kind == "ints":
+            return [r.randint(0, 100_000) for _ in range(values)]
+        if kind == "dates":
+            return [self._date() for _ in range(values)]
+        raise ValueError(f"Unknown field kind {kind}")
+
+    def _id_value(self, field: str, kind: str, number: int):
+        value = ID_FORMATS.get(field, f"{self.shape}-{{:08d}}").format(number)
+        return [value] if kind == "strings" else value
+
+    def record(self, number: int) -> dict:
+        r = self.random
+        record = {}
+        for field, kind, probability in self.fields:
+            if field in self.id_fields:
+                record[field] = self._id_value(field, kind, number)
+            elif r.random() < probability:
+                record[field] = self._value(kind)
+        return record
+
+    def records(self, count: int) -> list[dict]:
+        return [self.record(number) for number in range(count)]
+
+
+def generate(shape: str, count: int, seed: int = 0) -> list[dict]:
+    """Make count synthetic records shaped like the given index."""
+    return CorpusGenerator(shape, seed).records(count)
@@ -0,0 +1,273 @@
+"""Benchmark harvesting against local stand-ins, without touching production.
+
+Times fetching from and decoding pages of each type of source, each profile's
+map_record and whole copies into (stand-in) Elasticsearch and the null sink,
+using synthetic corpora shaped like our indexes. Run from the top of the repository:
+
+    python -m benchmarks.run --save baseline.json
+    python -m benchmarks.run --compare baseline.json
+"""
+
+import contextlib
+import io
+import json
+import platform
+import tempfile
+import time
+from functools import partial
+from importlib import import_module
+from pathlib import Path
+from typing import Callable
+
+import click
+
+import decoders
+import state
+from benchmarks.corpus import SHAPES, generate
+from benchmarks.standins import Corpora, serve
+from datasources import DataverseSearch, FronteraSearch, SolrSearch
+from harvest import run_copy
+
+GROUPS = ("search", "decode", "map", "copy")
+# Records in each page, as fetched by copy.
+PAGE_SIZE = 1000
+# Source searched for each source type, and copied from by the copy benchmarks.
+SOURCE_SHAPES = {"solr": "ursus", "dataverse": "dataverse", "frontera": "frontera"}
+SEARCHERS = {
+    "solr": (SolrSearch, "{url}/solr/{shape}"),
+    "dataverse": (DataverseSearch, "{url}/{shape}/api/search"),
+    "frontera": (FronteraSearch, "{url}/{shape}/solr-proxy"),
+}
+
+
+def best_time(function: Callable[[], int], repeat: int) -> tuple[int, float]:
+    """Run function repeat times, returning the number of records it
+    processed and the fastest time, which is the least affected by noise."""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        records = function()
+        times.append(time.perf_counter() - started)
+    return records, min(times)
+
+
+def search_benchmarks(url: str) -> dict[str, Callable[[], int]]:
+    benchmarks = {}
+    for source_type, shape in SOURCE_SHAPES.items():
+        searcher_class, source_url = SEARCHERS[source_type]
+        profile = import_module(SHAPES[shape][1])
+        searcher = searcher_class(source_url.format(url=url, shape=shape))
+
+        def search(searcher=searcher, profile=profile) -> int:
+            return sum(
+                1
+                for _ in searcher.search(
+                    getattr(profile, "SOURCE_QUERY", "*:*"),
+                    fields=getattr(profile, "SOURCE_FIELDS", None),
+                )
+            )
+
+        benchmarks[f"search/{source_type}"] = search
+    return benchmarks
+
+
+def decode_benchmarks(corpora: dict[str, list[dict]]) -> dict[str, Callable[[], int]]:
+    """Time decoding a page from each type of source with the standard library's
+    json, the fastest decoder installed (see decoders.py), and streamed."""
+    benchmarks = {}
+    pages = Corpora(corpora)
+    for source_type, shape in SOURCE_SHAPES.items():
+        body = pages.page_body(source_type, shape, 0, PAGE_SIZE, None, None)
+        searcher_class, _ = SEARCHERS[source_type]
+        items_path = getattr(searcher_class, "items_path", ("response", "docs"))
+        records = min(PAGE_SIZE, len(corpora[shape]))
+
+        def decode(loads: Callable, body=body, records=records) -> int:
+            loads(body)
+            return records
+
+        def stream(body=body, items_path=items_path) -> int:
+            chunks = (
+                body[i : i + decoders.CHUNK_SIZE]
+                for i in range(0, len(body), decoders.CHUNK_SIZE)
+            )
+            return sum(1 for _ in decoders.iter_json_items(chunks, items_path))
+
+        benchmarks[f"decode/{source_type}/json"] = partial(decode, json.loads)
+        if decoders.DECODER != "json":
+            benchmarks[f"decode/{source_type}/{decoders.DECODER}"] = partial(
+                decode, decoders.loads
+            )
+        benchmarks[f"decode/{source_type}/stream"] = stream
+    return benchmarks
+
+
+def map_benchmarks(corpora: dict[str, list[dict]]) -> dict[str, Callable[[], int]]:
+    benchmarks = {}
+    for shape, (_, profile_name, _) in SHAPES.items():
+        map_record = import_module(profile_name).map_record
+        docs = corpora[shape]
+
+        def map_records(map_record=map_record, docs=docs) -> int:
+            for doc in docs:
+                map_record(doc)
+            return len(docs)
+
+        benchmarks[f"map/{profile_name.split('.')[-1]}"] = map_records
+    return benchmarks
+
+
+def copy_benchmarks(url: str) -> dict[str, Callable[[], int]]:
+    benchmarks = {}
+    for source_type, shape in SOURCE_SHAPES.items():
+        _, source_url = SEARCHERS[source_type]
+
+        def copy(
+            sink: str, source_type=source_type, shape=shape, source_url=source_url
+        ) -> int:
+            # copy prints its progress; keep the benchmark output readable.
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = run_copy(
+                    destination_index_name=f"benchmark-{shape}",
+                    elastic_url=url,
+                    elastic_api_key=None,
+                    source_url=source_url.format(url=url, shape=shape),
+                    source_type=source_type,
+                    profile=SHAPES[shape][1],
+                    # Comparable between machines with different numbers of CPUs.
+                    workers=1,
+                    sink=sink,
+                )
+            if result.errors:
+                raise click.ClickException(f"Copy from {shape} had errors")
+            return result.completed
+
+        benchmarks[f"copy/{source_type}"] = partial(copy, "elasticsearch")
+        # Without loading, to tell how much of a copy's time that takes.
+        benchmarks[f"copy/{source_type}/null"] = partial(copy, "null")
+    return benchmarks
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Print results with their change from baseline, returning the names
+    of benchmarks which are more than tolerance (a fraction) slower."""
+    regressions = []
+    print(f"{'benchmark':<24} {'records':>8} {'seconds':>9} {'records/s':>11}  change")
+    for name, result in results.items():
+        line = (
+            f"{name:<24} {result['records']:>8} {result['seconds']:>9.3f} "
+            f"{result['per_sec']:>11.0f}"
+        )
+        if name in baseline:
+            change = result["per_sec"] / baseline[name]["per_sec"] - 1
+            line += f"  {change:+.1%}"
+            if change < -tolerance:
+                line += "  REGRESSION"
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+@click.command()
+@click.option(
+    "--records",
+    default=20_000,
+    show_default=True,
+    help="Number of records in each synthetic corpus.",
+)
+@click.option(
+    "--repeat",
+    default=3,
+    show_default=True,
+    help="Times to run each benchmark; the fastest run is reported.",
+)
+@click.option("--seed", default=0, show_default=True)
+@click.option(
+    "--only",
+    multiple=True,
+    type=click.Choice(GROUPS),
+    help="Only run these groups of benchmarks. Can be repeated.",
+)
+@click.option(
+    "--save",
+    type=click.Path(dir_okay=False),
+    help="Save the results as JSON, e.g. as a baseline for --compare.",
+)
+@click.option(
+    "--compare",
+    "baseline_path",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Compare with results saved with --save, failing on regressions.",
+)
+@click.option(
+    "--tolerance",
+    default=0.2,
+    show_default=True,
+    help="With --compare, fail if any benchmark is more than this fraction "
+    + "slower than the baseline.",
+)
+def main(
+    records: int,
+    repeat: int,
+    seed: int,
+    only: tuple[str],
+    save: str | None,
+    baseline_path: str | None,
+    tolerance: float,
+) -> None:
+    groups = only or GROUPS
+    baseline = {}
+    if baseline_path:
+        with open(baseline_path) as f:
+            saved = json.load(f)
+        if saved["records"] != records:
+            raise click.ClickException(
+                f"Baseline was run with --records {saved['records']}"
+            )
+        baseline = saved["results"]
+
+    print(f"Generating {len(SHAPES)} corpora of {records} records")
+    corpora = {shape: generate(shape, records, seed) for shape in SHAPES}
+
+    results = {}
+    with serve(corpora) as url, tempfile.TemporaryDirectory() as state_dir:
+        # Keep copy checkpoints and high-water marks out of the real state.
+        state.STATE_DIR = Path(state_dir)
+        benchmarks = {}
+        if "search" in groups:
+            benchmarks.update(search_benchmarks(url))
+        if "decode" in groups:
+            benchmarks.update(decode_benchmarks(corpora))
+        if "map" in groups:
+            benchmarks.update(map_benchmarks(corpora))
+        if "copy" in groups:
+            benchmarks.update(copy_benchmarks(url))
+        for name, function in benchmarks.items():
+            count, seconds = best_time(function, repeat)
+            results[name] = {
+                "records": count,
+                "seconds": round(seconds, 4),
+                "per_sec": round(count / seconds, 1),
+            }
+
+    regressions = compare(results, baseline, tolerance)
+    if save:
+        with open(save, "w") as f:
+            json.dump(
+                {
+                    "records": records,
+                    "seed": seed,
+                    "python": platform.python_version(),
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+    if regressions:
+        raise click.ClickException(
+            f"{len(regressions)} benchmarks regressed: {', '.join(regressions)}"
+        )
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,236 @@
+"""Local stand-ins for our sources and Elasticsearch, serving synthetic corpora.
+
+They speak just enough of each protocol for the searchers and the copy pipeline:
+
+/solr/<shape>/select, /solr/<shape>/schema/uniquekey, /solr/<shape>/admin/luke
+    Solr, with start/rows and cursorMark paging (sorted on id) and fl.
+/<shape>/api/search
+    the Dataverse Search API, with start/per_page paging.
+/<shape>/solr-proxy
+    Frontera's Solr proxy, with start/rows paging and fl.
+/, /_bulk, /<index>
+    Elasticsearch: bulk requests are acknowledged, but documents aren't kept.
+
+Queries and filters (fq) are not applied: every record matches.
+The server runs in its own process, so it doesn't compete with the code being
+benchmarked for the GIL, and pages are cached once serialized, so serving them
+costs about the same for every run.
+"""
+
+import json
+import multiprocessing
+from bisect import bisect_right
+from collections import Counter
+from contextlib import contextmanager
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Generator
+from urllib.parse import parse_qs, urlsplit
+
+ES_INFO = {
+    "name": "standin",
+    "cluster_name": "benchmarks",
+    "version": {"number": "7.17.0", "build_flavor": "default"},
+    "tagline": "You Know, for Search",
+}
+
+
+class Corpora:
+    """Records of each shape, sorted on id as Solr's cursor paging needs."""
+
+    def __init__(self, corpora: dict[str, list[dict]]):
+        self.docs = {
+            shape: sorted(docs, key=lambda doc: str(doc.get("id", "")))
+            for shape, docs in corpora.items()
+        }
+        self.ids = {
+            shape: [str(doc.get("id", "")) for doc in docs]
+            for shape, docs in self.docs.items()
+        }
+        self.page_body = lru_cache(maxsize=4096)(self._page_body)
+
+    def _page(self, shape: str, start: int, rows: int, fields: str | None) -> list:
+        page = self.docs[shape][start : start + rows]
+        if fields and fields != "*":
+            keep = fields.split(",")
+            page = [{k: doc[k] for k in keep if k in doc} for doc in page]
+        return page
+
+    def _page_body(
+        self,
+        protocol: str,
+        shape: str,
+        start: int,
+        rows: int,
+        fields: str | None,
+        cursor_mark: str | None,
+    ) -> bytes:
+        hits = len(self.docs[shape])
+        if protocol == "dataverse":
+            items = self._page(shape, start, rows, None)
+            response = {
+                "status": "OK",
+                "data": {
+                    "q": "*",
+                    "total_count": hits,
+                    "start": start,
+                    "items": items,
+                    "count_in_response": len(items),
+                },
+            }
+            return json.dumps(response).encode()
+
+        response = {"responseHeader": {"status": 0}}
+        if cursor_mark is not None:
+            # The cursor mark is simply the id of the last record returned.
+            if cursor_mark != "*":
+                start = bisect_right(self.ids[shape], cursor_mark)
+            docs = self._page(shape, start, rows, fields)
+            response["nextCursorMark"] = (
+                self.ids[shape][start + len(docs) - 1] if docs else cursor_mark
+            )
+        else:
+            docs = self._page(shape, start, rows, fields)
+        response["response"] = {"numFound": hits, "start": start, "docs": docs}
+        return json.dumps(response).encode()
+
+    def field_counts(self, shape: str) -> dict:
+        counts = Counter(field for doc in self.docs[shape] for field in doc)
+        return {
+            "fields": {
+                field: {"type": "string", "docs": count}
+                for field, count in counts.items()
+            }
+        }
+
+
+def _handler(corpora: Corpora) -> type[BaseHTTPRequestHandler]:
+    class StandInHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args) -> None:
+            pass
+
+        def _send(self, status: int, body: bytes | dict) -> None:
+            if isinstance(body, dict):
+                body = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            # The Elasticsearch client checks this header.
+            self.send_header("X-Elastic-Product", "Elasticsearch")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_body(self) -> bytes:
+            return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        def _search(self, protocol: str, shape: str, params: dict) -> None:
+            if shape not in corpora.docs:
+                self._send(404, {"error": f"No corpus {shape}"})
+                return
+
+            def param(name: str, default: Any = None) -> Any:
+                return params.get(name, [default])[0]
+
+            if protocol == "solr" and "cursorMark" in params and "sort" not in params:
+                self._send(400, {"error": {"msg": "Cursor requires a sort"}})
+                return
+            rows_param = "per_page" if protocol == "dataverse" else "rows"
+            body = corpora.page_body(
+                protocol,
+                shape,
+                int(param("start", 0)),
+                int(param(rows_param, 10)),
+                param("fl"),
+                param("cursorMark"),
+            )
+            self._send(200, body)
+
+        def _route(self, params: dict) -> None:
+            parts = urlsplit(self.path).path.strip("/").split("/")
+            if parts[0] == "solr" and len(parts) >= 3:
+                shape, endpoint = parts[1], "/".join(parts[2:])
+                if endpoint == "select":
+                    self._search("solr", shape, params)
+                elif endpoint == "schema/uniquekey":
+                    self._send(200, {"uniqueKey": "id"})
+                elif endpoint == "admin/luke" and shape in corpora.docs:
+                    self._send(200, corpora.field_counts(shape))
+                else:
+                    self._send(404, {"error": self.path})
+            elif parts[1:] == ["api", "search"]:
+                self._search("dataverse", parts[0], params)
+            elif parts[1:] == ["solr-proxy"]:
+                self._search("solr", parts[0], params)
+            elif parts == [""]:
+                self._send(200, ES_INFO)
+            else:
+                self._send(404, {"error": self.path})
+
+        def do_GET(self) -> None:
+            self._route(parse_qs(urlsplit(self.path).query))
+
+        def do_POST(self) -> None:
+            body = self._read_body()
+            path = urlsplit(self.path).path
+            if path.endswith("/_bulk"):
+                self._bulk(body)
+            else:
+                # pysolr posts long queries as a form.
+                params = parse_qs(urlsplit(self.path).query)
+                params.update(parse_qs(body.decode()))
+                self._route(params)
+
+        def _bulk(self, body: bytes) -> None:
+            items = []
+            lines = body.splitlines()
+            line = 0
+            while line < len(lines):
+                action, meta = next(iter(json.loads(lines[line]).items()))
+                items.append(
+                    {
+                        action: {
+                            "_index": meta.get("_index"),
+                            "_id": meta.get("_id"),
+                            "status": 200 if action == "delete" else 201,
+                        }
+                    }
+                )
+                # Every action but delete is followed by a document.
+                line += 1 if action == "delete" else 2
+            self._send(200, {"took": 1, "errors": False, "items": items})
+
+        def do_HEAD(self) -> None:
+            self._send(200, b"")
+
+        def do_PUT(self) -> None:
+            self._read_body()
+            self._send(200, {"acknowledged": True})
+
+        def do_DELETE(self) -> None:
+            self._send(200, {"acknowledged": True})
+
+    return StandInHandler
+
+
+def _serve(corpora: dict[str, list[dict]], ports: multiprocessing.Queue) -> None:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _handler(Corpora(corpora)))
+    ports.put(server.server_address[1])
+    server.serve_forever()
+
+
+@contextmanager
+def serve(corpora: dict[str, list[dict]]) -> Generator[str, Any, Any]:
+    """Serve corpora (records by shape) from a local server in another process,
+    while in the context. Yields the server's base URL."""
+    ports = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=_serve, args=(corpora, ports), name="standins", daemon=True
+    )
+    process.start()
+    try:
+        yield f"http://127.0.0.1:{ports.get(timeout=60)}"
+    finally:
+        process.terminate()
+        process.join()
@@ -0,0 +1,88 @@
+"""Benchmark how long the CLI takes to start, compared with the bare interpreter.
+
+Cron and job wrappers run centralsearch.py many times, so it should not import
+the libraries for sources and Elasticsearch until a command needs them. This
+fails if it does, or if starting takes more than --max-overhead longer than
+running an empty script. Run from the top of the repository:
+
+    python -m benchmarks.startup
+"""
+
+import statistics
+import subprocess
+import sys
+import time
+
+import click
+
+# Libraries which only commands using them should import.
+HEAVY_MODULES = ("elasticsearch", "pysolr", "requests", "urllib3", "datasources")
+COMMANDS = {
+    "bare interpreter": ["-c", "pass"],
+    "centralsearch.py --help": ["centralsearch.py", "--help"],
+    # Commands with a --source-type option, which mustn't look up installed
+    # drivers (see drivers.py) just to show their help.
+    "centralsearch.py copy --help": ["centralsearch.py", "copy", "--help"],
+    "centralsearch.py retry_failed --help": [
+        "centralsearch.py",
+        "retry_failed",
+        "--help",
+    ],
+}
+
+
+def median_time(args: list[str], repeat: int) -> float:
+    """Median of repeat runs of the interpreter with args, in seconds, which
+    varies less between runs of the benchmark than the fastest run."""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, *args], check=True, capture_output=True)
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+def heavy_imports() -> list[str]:
+    """Get the heavy modules imported just by loading the CLI."""
+    check = (
+        "import sys, centralsearch; "
+        f"print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", check], check=True, capture_output=True, text=True
+    )
+    return output.stdout.split()
+
+
+@click.command()
+@click.option(
+    "--repeat",
+    default=20,
+    show_default=True,
+    help="Times to run each command; the median run is reported.",
+)
+@click.option(
+    "--max-overhead",
+    default=0.05,
+    show_default=True,
+    help="Fail if the CLI takes more than this many seconds longer to start "
+    + "than the bare interpreter.",
+)
+def main(repeat: int, max_overhead: float) -> None:
+    times = {name: median_time(args, repeat) for name, args in COMMANDS.items()}
+    bare = times["bare interpreter"]
+    for name, seconds in times.items():
+        print(f"{name:<38} {seconds * 1000:>7.1f} ms  (+{(seconds - bare) * 1000:.1f})")
+
+    heavy = heavy_imports()
+    if heavy:
+        raise click.ClickException(f"centralsearch imports {', '.join(heavy)}")
+    slowest = max(times.values()) - bare
+    if slowest > max_overhead:
+        raise click.ClickException(
+            f"CLI startup is {slowest * 1000:.0f} ms slower than the bare interpreter"
+        )
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,219 @@
+import threading
+import time
+from contextlib import nullcontext
+from typing import Any, Generator, Iterable
+
+from elasticsearch import (
+    AuthenticationException,
+    AuthorizationException,
+    ConnectionTimeout,
+    Elasticsearch,
+    NotFoundError,
+    TransportError,
+)
+
+import metrics
+from decoders import dumps
+
+# Limits for bulk request sizes. Elasticsearch suggests requests of a few MB;
+# 100MB is its default http.max_content_length.
+MIN_CHUNK_DOCS = 50
+MAX_CHUNK_DOCS = 10_000
+MIN_CHUNK_BYTES = 1024 * 1024
+MAX_CHUNK_BYTES = 50 * 1024 * 1024
+# Bulk requests taking longer than this are made smaller; faster ones bigger.
+TARGET_LATENCY = 5.0
+REQUEST_TIMEOUT = 60
+MAX_RETRIES = 5
+INITIAL_BACKOFF = 2
+MAX_BACKOFF = 60
+# Errors which retrying won't fix (e.g. a missing index or bad credentials),
+# which stop loading; other failed requests are retried.
+FATAL_ERRORS = (NotFoundError, AuthenticationException, AuthorizationException)
+
+# Limits the number of bulk requests in flight across processes, e.g. all the
+# sources of harvest-all; None for no limit. Set in each process by limit_requests.
+_request_slots = None
+
+
+def limit_requests(slots) -> None:
+    """Make bulk requests in this process wait for one of slots, a semaphore
+    shared with other processes (e.g. a multiprocessing.BoundedSemaphore),
+    or None for no limit. Used as a ProcessPoolExecutor initializer."""
+    global _request_slots
+    _request_slots = slots
+
+
+def request_slots():
+    """Get this process's bulk request limit, to pass on to its own workers."""
+    return _request_slots
+
+
+class BulkSizer:
+    """Adapts bulk request sizes to what the Elasticsearch cluster can take,
+    shared by all bulk loaders in a process.
+
+    Sizes are limited by both number of documents and bytes, so small records
+    are sent in fewer requests and large ones don't make huge requests. Sizes
+    grow additively while requests are fast, and are halved when they are slow
+    or rejected (HTTP 429, when the cluster's write queue is full). Rejections
+    also make all loaders wait before their next request, with the wait doubling
+    while rejections continue, so the cluster gets time to catch up.
+    """
+
+    def __init__(
+        self,
+        chunk_docs: int = 1000,
+        chunk_bytes: int = 10 * 1024 * 1024,
+        target_latency: float = TARGET_LATENCY,
+    ):
+        self.chunk_docs = chunk_docs
+        self.chunk_bytes = chunk_bytes
+        self.target_latency = target_latency
+        self._backoff = 0.0
+        self._backoff_until = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        """Wait for any backoff after rejections, before sending a request."""
+        while (delay := self._backoff_until - time.monotonic()) > 0:
+            time.sleep(delay)
+
+    def record(self, latency: float, docs: int, size: int, rejected: int) -> None:
+        """Adjust sizes after a bulk request of docs documents and size bytes
+        which took latency seconds, of which rejected were rejected."""
+        with self._lock:
+            if rejected:
+                self._shrink()
+                self._backoff = min(
+                    max(self._backoff * 2, INITIAL_BACKOFF), MAX_BACKOFF
+                )
+                self._backoff_until = time.monotonic() + self._backoff
+                return
+            self._backoff = 0.0
+            if latency > self.target_latency:
+                self._shrink()
+            elif latency < self.target_latency / 2 and (
+                docs >= self.chunk_docs or size >= self.chunk_bytes * 0.9
+            ):
+                # Only grow if the request was full size; a small final chunk
+                # says nothing about bigger ones.
+                self.chunk_docs = min(
+                    self.chunk_docs + MIN_CHUNK_DOCS * 2, MAX_CHUNK_DOCS
+                )
+                self.chunk_bytes = min(
+                    self.chunk_bytes + MIN_CHUNK_BYTES, MAX_CHUNK_BYTES
+                )
+
+    def _shrink(self) -> None:
+        self.chunk_docs = max(self.chunk_docs // 2, MIN_CHUNK_DOCS)
+        self.chunk_bytes = max(self.chunk_bytes // 2, MIN_CHUNK_BYTES)
+
+
+def index_action(index: str, doc: dict) -> bytes:
+    """Serialize a document as a bulk index action, using its _id."""
+    doc = dict(doc)
+    meta = {"index": {"_index": index, "_id": doc.pop("_id")}}
+    return b"%b\n%b\n" % (dumps(meta), dumps(doc))
+
+
+def _chunks(
+    actions: Iterable[tuple[dict, bytes]], sizer: BulkSizer
+) -> Generator[list[tuple[dict, bytes]], Any, Any]:
+    """Group (document, action) pairs into chunks no bigger than the sizer's
+    current limits."""
+    chunk = []
+    chunk_bytes = 0
+    for doc, action in actions:
+        if chunk and (
+            len(chunk) >= sizer.chunk_docs
+            or chunk_bytes + len(action) > sizer.chunk_bytes
+        ):
+            yield chunk
+            chunk = []
+            chunk_bytes = 0
+        chunk.append((doc, action))
+        chunk_bytes += len(action)
+    if chunk:
+        yield chunk
+
+
+def _failed(doc: dict, index: str, error: TransportError) -> dict:
+    """Make a bulk response item for a document which couldn't be sent."""
+    return {
+        "index": {
+            "_index": index,
+            "_id": doc["_id"],
+            "status": error.status_code,
+            "error": repr(error),
+        }
+    }
+
+
+def bulk_load(
+    es_client: Elasticsearch,
+    index: str,
+    docs: Iterable[dict],
+    sizer: BulkSizer,
+) -> Generator[tuple[bool, dict], Any, Any]:
+    """Load documents (with their _id) into an index in bulk, sized by sizer.
+
+    Yields (ok, item) for each document, like elasticsearch.helpers.streaming_bulk.
+    Documents rejected with 429 are retried up to MAX_RETRIES times, as are whole
+    requests which failed (rejected, timed out, lost connections or server
+    errors), split to the new, smaller size; documents still failing are yielded
+    as failed. Other errors of documents are not retried, and FATAL_ERRORS are
+    raised.
+    """
+    actions = ((doc, index_action(index, doc)) for doc in docs)
+    for chunk in _chunks(actions, sizer):
+        pending = [(chunk, 0)]
+        while pending:
+            chunk, attempt = pending.pop()
+            sizer.wait()
+            body = b"".join(action for _, action in chunk)
+            if attempt:
+                metrics.count("bulk_retried_docs", len(chunk))
+            try:
+                with _request_slots or nullcontext():
+                    # Time only the request, not waiting for a slot.
+                    started = time.monotonic()
+                    with metrics.timer("bulk"):
+                        response = es_client.bulk(
+                            body=body,
+                            request_timeout=REQUEST_TIMEOUT,
+                        )
+            except TransportError as e:
+                if isinstance(e, FATAL_ERRORS):
+                    raise
+                # The whole request was rejected, took too long or failed.
+                if isinstance(e, ConnectionTimeout) or e.status_code == 429:
+                    metrics.count("bulk_rejections")
+                else:
+                    metrics.count("bulk_errors")
+                sizer.record(
+                    time.monotonic() - started, len(chunk), len(body), len(chunk)
+                )
+                if attempt == MAX_RETRIES:
+                    for doc, _ in chunk:
+                        yield False, _failed(doc, index, e)
+                    continue
+                pieces = list(_chunks(chunk, sizer))
+                pending.extend((piece, attempt + 1) for piece in reversed(pieces))
+                continue
+
+            rejected = []
+            for (doc, action), item in zip(chunk, response["items"]):
+                status = item["index"].get("status", 200)
+                if status == 429 and attempt < MAX_RETRIES:
+                    rejected.append((doc, action))
+                else:
+                    yield status < 300, item
+            metrics.count("bulk_bytes", len(body))
+            if rejected:
+                metrics.count("bulk_rejections")
+            sizer.record(
+                time.monotonic() - started, len(chunk), len(body), len(rejected)
+            )
+            if rejected:
+                pending.append((rejected, attempt + 1))
@@ -0,0 +1,47 @@
+import ast
+import csv
+import io
+import json
+import sys
+from collections import Counter
+from pprint import pprint
+from typing import Iterable, TextIO
+
+
+def count_fields(docs: Iterable[dict]) -> dict[str, int]:
+    """Count the number of docs each field occurs in."""
+    counts = Counter()
+    for doc in docs:
+        counts.update(doc.keys())
+    return dict(counts)
+
+
+def write_fields(
+    field_counts: dict[str, int], output_format: str = "pprint", output: TextIO = None
+) -> None:
+    """Write field counts, sorted by field name, in one of these formats:
+    pprint (as in field_lists/*.txt), json or csv (with field and count columns)."""
+    output = output or sys.stdout
+    field_counts = dict(sorted(field_counts.items()))
+    if output_format == "pprint":
+        pprint(field_counts, stream=output, width=132)
+    elif output_format == "json":
+        json.dump(field_counts, output, indent=4)
+        output.write("\n")
+    elif output_format == "csv":
+        writer = csv.writer(output)
+        writer.writerow(["field", "count"])
+        writer.writerows(field_counts.items())
+    else:
+        raise ValueError(f"Unsupported {output_format=}")
+
+
+def read_fields(input_file: TextIO) -> dict[str, int]:
+    """Read field counts written by write_fields, in any of its formats."""
+    text = input_file.read()
+    if text.startswith("field,count"):
+        rows = csv.reader(io.StringIO(text))
+        next(rows)
+        return {field: int(count) for field, count in rows}
+    # pprint and json output are both Python literals.
+    return ast.literal_eval(text.strip())
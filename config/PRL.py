@@ -1,15 +1,13 @@
-SOURCE_QUERY = "*:*"
-
+from mapping import compile_profile
 
-def get_id(record: dict) -> str:
-    return record.get("id")
-
-
-def map_record(record: dict) -> dict:
+SOURCE_QUERY = "*:*"
+# Source fields needed to get each record's id, for sync_deletes.
+ID_FIELDS = ["id"]
 
+PROFILE = {
     # only take a selection of fields for now
     # rename fields for consistency
-    fields_to_keep = {
+    "keep": {
         "id": "id",
         "title_keyword": "titles",
         "description_keyword": "descriptions",
@@ -19,26 +17,20 @@ def map_record(record: dict) -> dict:
         "contributor_keyword": "contributors",
         "type_keyword": "types",
         "external_link": "url",
-    }
-
-    output_record = {}
-    for fld in fields_to_keep.keys():
-        if fld in record and record[fld] != [" "]:
-            output_record[fields_to_keep[fld]] = record[fld]
-
+    },
+    "skip_values": [[" "]],
     # Add names for (some) consistency with other sources,
     # but keep separate fields as well for distinction.
-    # None of these names is guaranteed to exist, so create names
-    # only when at least one does.
-    tmp_names = [
-        output_record.get("creators"),
-        output_record.get("contributors"),
-    ]
-    # Each of the values in tmp_names is a list already, so add just the values
-    # from each field in tmp_names.
-    output_record["names"] = [name for field in tmp_names if field for name in field]
-
+    "concat": {"names": ["creators", "contributors"]},
+    "keep_empty": ["names"],
     # add new field for source
-    output_record["source"] = "PRL"
+    "constants": {"source": "PRL"},
+}
+
+map_record = compile_profile(PROFILE)
+# Source fields used by map_record; copy only fetches these.
+SOURCE_FIELDS = map_record.source_fields
 
-    return output_record
+
+def get_id(record: dict) -> str:
+    return record.get("id")
@@ -1,18 +1,15 @@
+from mapping import compile_profile
+
 # Search for everything, with a hard limit to published records only.
 # https://guides.dataverse.org/en/latest/api/search.html
 SOURCE_QUERY = "*&publicationStatus:Published"
+# Source fields needed to get each record's id, for sync_deletes.
+ID_FIELDS = ["url"]
 
-
-def get_id(record: dict) -> str:
-    # Only type=dataverse seems to have reliable "identifier" field;
-    # use url field for now.
-    return record.get("url")
-
-
-def map_record(record: dict) -> dict:
+PROFILE = {
     # Only take a selection of fields for now;
     # rename fields for consistency.
-    fields_to_keep = {
+    "keep": {
         "id": "id",
         "type": "types",
         "url": "url",
@@ -21,19 +18,17 @@ def map_record(record: dict) -> dict:
         "description": "descriptions",
         "subjects": "subjects",
         "keywords": "keywords",
-    }
-
-    output_record = {}
-    for fld in fields_to_keep.keys():
-        if fld in record:
-            output_record[fields_to_keep[fld]] = record[fld]
-
+    },
     # Make each of these fields a list, consistent with other sources.
-    for field in ["descriptions", "publishers", "titles", "types"]:
-        if field in output_record:
-            output_record[field] = [output_record[field]]
-
+    "wrap_lists": ["descriptions", "publishers", "titles", "types"],
     # Add new field for source
-    output_record["source"] = "Dataverse"
+    "constants": {"source": "Dataverse"},
+}
+
+map_record = compile_profile(PROFILE)
+
 
-    return output_record
+def get_id(record: dict) -> str:
+    # Only type=dataverse seems to have reliable "identifier" field;
+    # use url field for now.
+    return record.get("url")
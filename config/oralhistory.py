@@ -1,50 +1,37 @@
-SOURCE_QUERY = "*:*"
-
-
-def get_id(record: dict) -> str:
-    return record.get("id")
+from mapping import compile_profile
 
+SOURCE_QUERY = "*:*"
+# Source fields needed to get each record's id, for sync_deletes.
+ID_FIELDS = ["id"]
 
-def map_record(record: dict) -> dict:
+PROFILE = {
     # Only take a selection of fields for now.
     # Rename fields as needed for consistency with other sources.
-    fields_to_keep = {
+    "keep": {
         "id": "id",
         "title_display": "titles",
         "subject_topic_facet": "subjects",
         "author_display": "names",
-        # TODO: interviewee_display - add to names, as a list?
-    }
-
-    output_record = {}
-    for fld in fields_to_keep.keys():
-        if fld in record:
-            output_record[fields_to_keep[fld]] = record[fld]
-
-    # Every record has title_display (now in titles);
-    # add subtitle_display if it exists.
-    # Either way, make titles a list.
-    if "titles" in output_record:
-        output_record["titles"] = [output_record["titles"]]
-    if "subtitle_display" in record:
-        output_record["titles"].append(record["subtitle_display"])
-
-    # Make names a list, and add interviewee_display if it exists.
-    if "names" in output_record:
-        output_record["names"] = [output_record["names"]]
-        if "interviewee_display" in record:
-            output_record["names"].append(record["interviewee_display"])
-
+    },
+    # Make titles and names lists, adding subtitle_display and
+    # interviewee_display to them if they exist.
+    "wrap_lists": ["titles", "names"],
+    "append": {
+        "titles": ["subtitle_display"],
+        "names": ["interviewee_display"],
+    },
     # Clean up subjects, which often has duplicates in solr data.
-    if "subjects" in output_record and isinstance(output_record["subjects"], list):
-        output_record["subjects"] = sorted(set(output_record["subjects"]))
-
+    "dedupe": ["subjects"],
     # URL isn't in original metadata, but we can construct it.
-    output_record["url"] = (
-        f"https://oralhistory.library.ucla.edu/catalog/{get_id(record)}"
-    )
-
+    "templates": {"url": "https://oralhistory.library.ucla.edu/catalog/{id}"},
     # Add new field for source.
-    output_record["source"] = "Oral History"
+    "constants": {"source": "Oral History"},
+}
 
-    return output_record
+map_record = compile_profile(PROFILE)
+# Source fields used by map_record; copy only fetches these.
+SOURCE_FIELDS = map_record.source_fields
+
+
+def get_id(record: dict) -> str:
+    return record.get("id")
@@ -1,13 +1,15 @@
-SOURCE_QUERY = "ark_ssi:*"
-
-
-def get_id(record: dict) -> str:
-    return f"https://digital.library.ucla.edu/catalog/{record['ark_ssi']}"
+from mapping import compile_profile
 
+SOURCE_QUERY = "ark_ssi:*"
+# Source fields needed to get each record's id, for sync_deletes.
+ID_FIELDS = ["ark_ssi"]
+# Used by copy --since to harvest only recently changed records.
+MODIFIED_FIELD = "system_modified_dtsi"
 
-def map_record(record: dict) -> dict:
+PROFILE = {
+    "keep_all": True,
     # These fields should not be included in the output record.
-    fields_to_remove = [
+    "drop": [
         "_version_",
         "accessControl_ssim",
         "accessTo_ssim",
@@ -43,9 +45,9 @@ def map_record(record: dict) -> dict:
         "system_modified_dtsi",
         "timestamp",
         "ursus_id_ssie",
-    ]
+    ],
     # These fields should be duplicated with new names in the output record.
-    fields_to_duplicate = {
+    "duplicate": {
         "title_tesim": "titles",
         "artist_tesim": "artists",
         "author_tesim": "authors",
@@ -62,43 +64,30 @@ def map_record(record: dict) -> dict:
         "subject_tesim": "subjects",
         "subject_topic_tesim": "subject_topics",
         "genre_tesim": "types",
-    }
-
-    output_record = {}
-    for key, value in record.items():
-        # Skip unwanted fields.
-        if key in fields_to_remove:
-            continue
-        # Copy existing fields.
-        output_record[key] = value
-        # Duplicate fields with new names.
-        if key in fields_to_duplicate.keys():
-            new_key = fields_to_duplicate[key]
-            output_record[new_key] = value
-
+    },
     # Add "names" field for (some) consistency with other sources,
     # but keep separate fields as well for distinction.
     # None of these names is guaranteed to exist, so create names
     # only when at least one does.
-    tmp_names = [
-        output_record.get("artists"),
-        output_record.get("authors"),
-        output_record.get("composers"),
-        output_record.get("creators"),
-        output_record.get("directors"),
-        output_record.get("editors"),
-        output_record.get("photographers"),
-        output_record.get("producers"),
-    ]
-    # Each of the values in tmp_names is a list already, so add just the values
-    # from each field in tmp_names.
-    names = [name for field in tmp_names if field for name in field]
-    if names:
-        output_record["names"] = names
-
+    "concat": {
+        "names": [
+            "artists",
+            "authors",
+            "composers",
+            "creators",
+            "directors",
+            "editors",
+            "photographers",
+            "producers",
+        ]
+    },
     # add fields for url and source
-    output_record["url"] = (
-        f"https://digital.library.ucla.edu/catalog/{output_record['ark_ssi']}"
-    )
-    output_record["source"] = "Ursus"
-    return output_record
+    "templates": {"url": "https://digital.library.ucla.edu/catalog/{ark_ssi}"},
+    "constants": {"source": "Ursus"},
+}
+
+map_record = compile_profile(PROFILE)
+
+
+def get_id(record: dict) -> str:
+    return f"https://digital.library.ucla.edu/catalog/{record['ark_ssi']}"
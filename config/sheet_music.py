@@ -1,34 +1,33 @@
-SOURCE_QUERY = "*:*"
-
+from mapping import compile_profile
 
-def get_id(record: dict) -> str:
-    return record.get("id")
-
-
-def map_record(record: dict) -> dict:
+SOURCE_QUERY = "*:*"
+# Source fields needed to get each record's id, for sync_deletes.
+ID_FIELDS = ["id", "collectionKey"]
 
+PROFILE = {
     # only take a selection of fields for now
     # use the "keyword" version of fields since these are deduped, but rename them
-    fields_to_keep = {
+    "keep": {
         "id": "id",
         "title_keyword": "titles",
         "publisher_keyword": "publishers",
         "subjectTopic_keyword": "subjects",
         "nameNamePart_keyword": "names",
         "url_keyword": "url",
-    }
-
-    output_record = {}
-    for fld in fields_to_keep.keys():
-        if fld in record:
-            output_record[fields_to_keep[fld]] = record[fld]
-
+    },
     # URL for MODS record isn't in original metadata, but we can construct it
-    output_record["mods_url"] = (
-        "https://static.library.ucla.edu/sheetmusic/mods/"
-        + f"{record['collectionKey'][0]}/{record['id']}"
-    )
+    "templates": {
+        "mods_url": "https://static.library.ucla.edu/sheetmusic/mods/"
+        + "{collectionKey[0]}/{id}"
+    },
     # add new field for source
-    output_record["source"] = "Sheet Music"
+    "constants": {"source": "Sheet Music"},
+}
+
+map_record = compile_profile(PROFILE)
+# Source fields used by map_record; copy only fetches these.
+SOURCE_FIELDS = map_record.source_fields
 
-    return output_record
+
+def get_id(record: dict) -> str:
+    return record.get("id")
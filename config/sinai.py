@@ -1,15 +1,14 @@
-SOURCE_QUERY = "ark_ssi:*"
-
-
-def get_id(record: dict) -> str:
-    return f"https://digital.library.ucla.edu/catalog/{record['ark']}"
+from mapping import compile_profile
 
+SOURCE_QUERY = "ark_ssi:*"
+# Source fields needed to get each record's id, for sync_deletes.
+ID_FIELDS = ["ark_ssi"]
 
-def map_record(record: dict) -> dict:
+PROFILE = {
     # Only take a selection of fields for now;
     # rename fields for consistency.
     # There are MANY more fields we could consider using.
-    fields_to_keep = {
+    "keep": {
         "id": "id",
         "ark_ssi": "ark",
         "title_tesim": "titles",
@@ -29,36 +28,33 @@ def map_record(record: dict) -> dict:
         "subject_topic_tesim": "subject_topics",
         "genre_tesim": "types",
         "external_link": "url",
-    }
-
-    output_record = {}
-    for fld in fields_to_keep.keys():
-        if fld in record and record[fld] != [" "]:
-            output_record[fields_to_keep[fld]] = record[fld]
-
+    },
+    "skip_values": [[" "]],
     # Add names for (some) consistency with other sources,
     # but keep separate fields as well for distinction.
     # None of these names is guaranteed to exist, so create names
     # only when at least one does.
-    tmp_names = [
-        output_record.get("artists"),
-        output_record.get("authors"),
-        output_record.get("composers"),
-        output_record.get("creators"),
-        output_record.get("directors"),
-        output_record.get("editors"),
-        output_record.get("photographers"),
-        output_record.get("producers"),
-    ]
-    # Each of the values in tmp_names is a list already, so add just the values
-    # from each field in tmp_names.
-    names = [name for field in tmp_names if field for name in field]
-    if names:
-        output_record["names"] = names
-
+    "concat": {
+        "names": [
+            "artists",
+            "authors",
+            "composers",
+            "creators",
+            "directors",
+            "editors",
+            "photographers",
+            "producers",
+        ]
+    },
     # add fields for url and source
-    output_record["url"] = (
-        f"https://digital.library.ucla.edu/catalog/{output_record['ark']}"
-    )
-    output_record["source"] = "Sinai"
-    return output_record
+    "templates": {"url": "https://digital.library.ucla.edu/catalog/{ark_ssi}"},
+    "constants": {"source": "Sinai"},
+}
+
+map_record = compile_profile(PROFILE)
+# Source fields used by map_record; copy only fetches these.
+SOURCE_FIELDS = map_record.source_fields
+
+
+def get_id(record: dict) -> str:
+    return f"https://digital.library.ucla.edu/catalog/{record['ark']}"
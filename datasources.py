@@ -1,33 +1,209 @@
+import re
 import requests
 from abc import ABC, abstractmethod
-from typing import Any, Generator
-from pysolr import Solr
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Generator, Iterable, Iterator
+from pysolr import Results, Solr, SolrError
+from requests.adapters import HTTPAdapter
 from retry.api import retry_call
-from pprint import pprint
+import decoders
+import metrics
+from census import count_fields
+from drivers import (
+    CURSOR_PAGING,
+    FIELD_COUNTS,
+    FIELD_PROJECTION,
+    ID_LOOKUP,
+    PARALLEL_SLICES,
+    PREFETCH,
+    get_driver,
+)
+from dumps import read_chunk, read_manifest
+from urllib.parse import quote
+
+
+class _TransientError(Exception):
+    """Wraps an error from a source which retrying might fix."""
+
+
+def _is_client_error(error: Exception) -> bool:
+    """Check whether an error is the source rejecting a request (HTTP 4xx,
+    other than timeouts and rate limiting), which retrying won't fix."""
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+    elif isinstance(error, SolrError):
+        match = re.search(r"\(HTTP (\d+)\)", str(error))
+        status = int(match[1]) if match else 0
+    else:
+        return False
+    return 400 <= status < 500 and status not in (408, 429)
+
+
+def _retry_call(function: Callable, *args, **kwargs) -> Any:
+    """Call function until it succeeds, retrying errors other than the source
+    rejecting the request, and counting the calls which fail."""
+
+    def call():
+        try:
+            return function(*args, **kwargs)
+        except Exception as error:
+            if _is_client_error(error):
+                raise
+            metrics.count("source_retries")
+            raise _TransientError(error) from error
+
+    return retry_call(call, exceptions=_TransientError)
+
+
+def _rejects_cursor(error: SolrError) -> bool:
+    """Check whether a Solr error is a bad request because of cursorMark
+    or its sort, rather than e.g. a connection failure."""
+    message = str(error).lower()
+    return "(http 400)" in message and ("cursor" in message or "sort" in message)
+
+
+def _counted(chunks: Iterable[bytes]) -> Generator[bytes, Any, Any]:
+    """Pass on the chunks of a response, counting their bytes."""
+    for chunk in chunks:
+        metrics.count("source_bytes", len(chunk))
+        yield chunk
+
+
+def _timed_batch(lines: Iterator[dict], size: int) -> list[dict]:
+    """Read a batch of records from a dump, timed as a page fetch."""
+    with metrics.timer("fetch"):
+        batch = list(islice(lines, size))
+    metrics.count("source_docs", len(batch))
+    return batch
+
+
+def terms_filter(field: str, values: list[str]) -> str:
+    """Get a Solr filter query for records whose field has any of values
+    (which can't contain commas)."""
+    return f"{{!terms f={field}}}{','.join(values)}"
 
 
 class BaseSearch(ABC):
+    # Query for all records, for get_fields.
+    default_query = "*:*"
+    # Source field with each record's last modification date,
+    # used to harvest only records changed since a given time.
+    modified_field: str | None = None
+    # What this driver can do; see drivers.py.
+    capabilities: frozenset[str] = frozenset()
+
     @property
     @abstractmethod
     def hits(self) -> int: ...
 
     @abstractmethod
+    def search_pages(
+        self,
+        query: str,
+        rows_per_batch: int = 1000,
+        max_records: int = 999_999_999,
+        resume: dict | None = None,
+        **kwargs,
+    ) -> Generator[tuple[list[dict], dict], Any, Any]:
+        """Search for records, yielding them a page at a time, each with the
+        position after that page: passed as resume, the search continues
+        from there. Positions are dicts which can be saved as JSON, with the
+        number of records fetched so far as "fetched"; max_records includes them.
+        """
+
     def search(
         self,
         query: str,
         rows_per_batch: int = 1000,
         max_records: int = 999_999_999,
         **kwargs,
-    ) -> Generator[dict, Any, Any]: ...
+    ) -> Generator[dict, Any, Any]:
+        for docs, _ in self.search_pages(query, rows_per_batch, max_records, **kwargs):
+            yield from docs
+
+    def get_fields(self, sample: int | None = None, **kwargs) -> dict[str, int]:
+        """Count the number of records each field occurs in,
+        in all records or in the first sample records."""
+        results = self.search(
+            self.default_query,
+            rows_per_batch=1000,
+            max_records=sample or 999_999_999,
+            **kwargs,
+        )
+        return count_fields(results)
+
+    def fetch_by_ids(
+        self,
+        query: str,
+        id_field: str,
+        ids: list[str],
+        batch_size: int = 500,
+        **kwargs,
+    ) -> Generator[dict, Any, Any]:
+        """Fetch the records matching query whose id_field is one of ids,
+        searching for batch_size ids at a time."""
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start : start + batch_size]
+            # Several records can share an id, so page through all the hits
+            # rather than stopping at one per id.
+            yield from self.search(
+                query,
+                rows_per_batch=len(batch),
+                filters=[terms_filter(id_field, batch)],
+                **kwargs,
+            )
 
-    @abstractmethod
-    def get_fields(self, *args, **kwargs) -> None: ...
+    def since_filter(self, since: str, modified_field: str | None = None) -> str:
+        """Get a filter query for records modified at or after since,
+        a timestamp like 2024-01-31T00:00:00Z."""
+        return f"{self.get_modified_field(modified_field)}:[{since} TO *]"
+
+    def get_modified_field(self, modified_field: str | None = None) -> str:
+        """Get the modification date field: the profile's, if given,
+        otherwise the source's default."""
+        field = modified_field or self.modified_field
+        if not field:
+            raise NotImplementedError(
+                f"{type(self).__name__} can't filter by modification date"
+            )
+        return field
 
 
-class DataverseSearch(BaseSearch):
-    def __init__(self, source_url: str):
+class HttpSearch(BaseSearch):
+    """Base for sources searched via plain HTTP requests, paging by offset.
+
+    Requests go through one session, so connections are kept alive and reused
+    rather than set up again for every page. After the first page, which gives
+    the number of hits, up to concurrency pages are fetched at the same time;
+    records are still returned in order.
+    """
+
+    capabilities = frozenset({PREFETCH})
+    # Keys of the array of records in each page, for streamed pages.
+    items_path: tuple[str, ...]
+
+    def __init__(self, source_url: str, concurrency: int = 4):
         self.source_url = source_url
+        self.concurrency = concurrency
         self._hits: int = 0
+        self._session = requests.Session()
+        self._pool_size = 0
+        self._size_pool(concurrency)
+
+    def _size_pool(self, concurrency: int) -> None:
+        """Make sure the session keeps enough connections alive for
+        concurrency requests at a time."""
+        if concurrency <= self._pool_size:
+            return
+        adapter = HTTPAdapter(pool_maxsize=concurrency)
+        for prefix in ("http://", "https://"):
+            old_adapter = self._session.adapters.get(prefix)
+            self._session.mount(prefix, adapter)
+            if old_adapter:
+                old_adapter.close()
+        self._pool_size = concurrency
 
     @property
     def hits(self) -> int:
@@ -35,82 +211,203 @@ class DataverseSearch(BaseSearch):
         # start being evaluated by the caller.
         return self._hits
 
-    def search(
+    @abstractmethod
+    def _page_url(self, query: str, start: int, rows: int, extra_params: str) -> str:
+        """Get the URL for one page of search results."""
+
+    @abstractmethod
+    def _parse_page(self, response: dict) -> tuple[list[dict], int]:
+        """Get the records and total number of hits from a page of results."""
+
+    def _fields_params(self, fields: list[str] | None) -> str:
+        """Get any extra URL parameters needed to return only the given fields."""
+        return ""
+
+    def _fetch_page(self, url: str, stream: bool = False) -> list[dict]:
+        with metrics.timer("fetch"):
+            if stream:
+                response = _retry_call(self._fetch_streamed, url)
+            else:
+                results = _retry_call(self._get, url)
+                metrics.count("source_bytes", len(results.content))
+                with metrics.timer("decode"):
+                    response = decoders.loads(results.content)
+        docs, self._hits = self._parse_page(response)
+        metrics.count("source_docs", len(docs))
+        return docs
+
+    def _get(self, url: str) -> requests.Response:
+        response = self._session.get(url)
+        response.raise_for_status()
+        return response
+
+    def _fetch_streamed(self, url: str) -> dict:
+        """Get a page, decoding its records as they arrive, so the whole
+        response is never held in memory (as well as its records)."""
+        envelope = {}
+        with self._session.get(url, stream=True) as results:
+            results.raise_for_status()
+            chunks = _counted(results.iter_content(decoders.CHUNK_SIZE))
+            docs = list(decoders.iter_json_items(chunks, self.items_path, envelope))
+        # Put the records back in the response, for _parse_page.
+        parent = envelope
+        for key in self.items_path[:-1]:
+            parent = parent.setdefault(key, {})
+        parent[self.items_path[-1]] = docs
+        return envelope
+
+    def search_pages(
         self,
         query: str,
         rows_per_batch: int = 1000,
         max_records: int = 999_999_999,
+        since: str | None = None,
+        modified_field: str | None = None,
+        fields: list[str] | None = None,
+        concurrency: int | None = None,
+        resume: dict | None = None,
+        filters: list[str] | None = None,
+        stream: bool = False,
         **kwargs,
-    ) -> Generator[dict, Any, Any]:
-        # Minimal valid response looks like this:
-        # {
-        #     "status": "OK",
-        #     "data": {
-        #         "q": "*",
-        #         "total_count": 0,
-        #         "start": 0,
-        #         "spelling_alternatives": {},
-        #         "items": [],
-        #         "count_in_response": 0,
-        #     },
-        # }
-
-        # TODO: Error handling
-        # Don't fetch more records per batch than max wanted.
-        rows_per_batch = min(rows_per_batch, max_records)
-        # Initialize the loop
-        start = 0
-        self._hits = max_records
-        while start < self._hits and start < max_records:
+    ) -> Generator[tuple[list[dict], dict], Any, Any]:
+        """See BaseSearch.search_pages. If stream, each page's records are
+        decoded as the response arrives, rather than after reading all of it."""
+        filters = list(filters or [])
+        if since:
+            filters.append(self.since_filter(since, modified_field))
+        extra_params = "".join(f"&fq={quote(fq)}" for fq in filters)
+        extra_params += self._fields_params(fields)
+        concurrency = concurrency or self.concurrency
+        self._size_pool(concurrency)
+        first_start = resume["start"] if resume else 0
+
+        def page(start: int) -> tuple[str, dict]:
             # Make sure final batch does not exceed max wanted.
-            if start + rows_per_batch > max_records:
-                rows_per_batch = max_records - start
-
-            query_url = (
-                f"{self.source_url}?q={query}&start={start}&per_page={rows_per_batch}"
+            rows = min(rows_per_batch, max_records - start)
+            url = self._page_url(query, start, rows, extra_params)
+            return url, {"start": start + rows, "fetched": start + rows}
+
+        if first_start >= max_records:
+            return
+        # The first page gives the number of hits, and so the remaining pages.
+        url, position = page(first_start)
+        yield self._fetch_page(url, stream), position
+        pages = (
+            page(start)
+            for start in range(
+                first_start + rows_per_batch,
+                min(self._hits, max_records),
+                rows_per_batch,
             )
+        )
+
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        try:
+            pending = deque()
+            for url, position in pages:
+                pending.append(
+                    (executor.submit(self._fetch_page, url, stream), position)
+                )
+                if len(pending) >= concurrency:
+                    future, position = pending.popleft()
+                    yield future.result(), position
+            while pending:
+                future, position = pending.popleft()
+                yield future.result(), position
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Patterns of the urls which identify Dataverse records, with the Search API
+# filter query for each: datasets (and some files) by persistent id, files by
+# id and dataverses by alias.
+DATAVERSE_URL_FILTERS = (
+    (
+        re.compile(r"^https?://doi\.org/(.+)$"),
+        'dsPersistentId:"doi:{0}" OR filePersistentId:"doi:{0}"',
+    ),
+    (
+        re.compile(r"^https?://hdl\.handle\.net/(.+)$"),
+        'dsPersistentId:"hdl:{0}" OR filePersistentId:"hdl:{0}"',
+    ),
+    (re.compile(r"/api/access/datafile/(\d+)$"), "entityId:{0}"),
+    (re.compile(r"/dataverse/([\w-]+)$"), 'identifier:"{0}"'),
+)
+
+
+def dataverse_url_filter(url: str) -> str | None:
+    """Get a Search API filter query for the Dataverse record with url,
+    or None if the url isn't one of DATAVERSE_URL_FILTERS."""
+    for pattern, template in DATAVERSE_URL_FILTERS:
+        match = pattern.search(url)
+        if match:
+            return f"({template.format(match.group(1))})"
+    return None
+
+
+class DataverseSearch(HttpSearch):
+    default_query = "*&publicationStatus:Published"
+    modified_field = "dateSort"
+    capabilities = HttpSearch.capabilities | {ID_LOOKUP}
+    items_path = ("data", "items")
+
+    # Minimal valid response looks like this:
+    # {
+    #     "status": "OK",
+    #     "data": {
+    #         "q": "*",
+    #         "total_count": 0,
+    #         "start": 0,
+    #         "spelling_alternatives": {},
+    #         "items": [],
+    #         "count_in_response": 0,
+    #     },
+    # }
+
+    def _page_url(self, query: str, start: int, rows: int, extra_params: str) -> str:
+        return (
+            f"{self.source_url}?q={query}&start={start}&per_page={rows}{extra_params}"
+        )
+
+    def _parse_page(self, response: dict) -> tuple[list[dict], int]:
+        # TODO: Error handling
+        data = response.get("data")
+        return data.get("items"), data.get("total_count")
 
-            results = retry_call(requests.get, fargs=[query_url])
-            data = results.json().get("data")
-            self._hits = data.get("total_count")
-            start += rows_per_batch
-
-            for doc in data.get("items"):
-                yield doc
-
-    def get_fields(self, *args, **kwargs):
-        rows_per_batch = 1000
-        max_records = 999_999_999
-        query = "*&publicationStatus:Published"
-        all_keys = {}
-        # Initialize the loop
-        start = 0
-        self._hits = max_records
-        while start < self._hits and start < max_records:
-            # Make sure final batch does not exceed max wanted.
-            if start + rows_per_batch > max_records:
-                rows_per_batch = max_records - start
-
-            query_url = (
-                f"{self.source_url}?"
-                f"q={query}&start={start}&per_page={rows_per_batch}"
-            )
-            results = retry_call(requests.get, fargs=[query_url])
-            data = results.json().get("data")
-            self._hits = data.get("total_count")
-            start += rows_per_batch
+    # The Search API can't limit the fields returned, so _fields_params is not
+    # overridden: there is no equivalent of the fields (fl) argument of other searchers.
 
-            docs = data.get("items")
-            for doc in docs:
-                for key in doc.keys():
-                    if key in all_keys.keys():
-                        all_keys[key] = all_keys[key] + 1
-                    else:
-                        all_keys[key] = 1
-        pprint(dict(sorted(all_keys.items())), width=132)
+    def fetch_by_ids(
+        self,
+        query: str,
+        id_field: str,
+        ids: list[str],
+        batch_size: int = 50,
+        **kwargs,
+    ) -> Generator[dict, Any, Any]:
+        """Fetch the records whose url is one of ids, filtering on the persistent
+        id, file id or dataverse alias in each url. Batches are smaller than for
+        other sources, since the filters are in the URL of each request; urls
+        which aren't like these can't be fetched, so aren't returned."""
+        if id_field != "url":
+            raise NotImplementedError("Dataverse records can only be fetched by url")
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start : start + batch_size]
+            filters = [f for f in map(dataverse_url_filter, batch) if f]
+            if not filters:
+                continue
+            wanted = set(batch)
+            # A dataset's persistent id can also match its files, which aren't wanted.
+            for doc in self.search(query, filters=[" OR ".join(filters)], **kwargs):
+                if doc.get("url") in wanted:
+                    yield doc
 
 
 class SolrSearch(BaseSearch):
+    capabilities = frozenset(
+        {CURSOR_PAGING, FIELD_PROJECTION, PARALLEL_SLICES, ID_LOOKUP, FIELD_COUNTS}
+    )
+
     def __init__(self, source_url: str):
         self.source_url = source_url
         self._hits: int = 0
@@ -121,130 +418,337 @@ class SolrSearch(BaseSearch):
         # start being evaluated by the caller.
         return self._hits
 
-    def search(
+    def search_pages(
         self,
         query: str,
         rows_per_batch: int = 1000,
         max_records: int = 999_999_999,
         def_type: str = "lucene",
+        paging: str = "cursor",
+        partition: tuple[int, int] | None = None,
+        since: str | None = None,
+        modified_field: str | None = None,
+        fields: list[str] | None = None,
+        resume: dict | None = None,
+        filters: list[str] | None = None,
         **kwargs,
+    ) -> Generator[tuple[list[dict], dict], Any, Any]:
+        solr_client = Solr(
+            self.source_url, timeout=10, decoder=metrics.TimedJSONDecoder()
+        )
+        search_params = {"defType": def_type, "fq": list(filters or [])}
+        unique_key = self._get_unique_key()
+
+        # Only return the given fields, if any; by default Solr returns all of them.
+        if fields:
+            search_params["fl"] = ",".join(fields)
+
+        if since:
+            search_params["fq"].append(self.since_filter(since, modified_field))
+
+        # partition is (worker, workers): restrict results to one of several
+        # disjoint slices of the index, based on a hash of the uniqueKey,
+        # so that separate processes can harvest slices in parallel.
+        if partition:
+            worker, workers = partition
+            search_params["fq"].append(f"{{!hash workers={workers} worker={worker}}}")
+            search_params["partitionKeys"] = unique_key
+
+        # Deep paging with start/rows gets slower with every page, since Solr
+        # has to collect and skip all earlier rows; cursorMark paging does not.
+        # Cursors require sorting on the uniqueKey, and not every core can do that,
+        # so fall back to offset paging when the cursor can't be used.
+        if paging == "cursor":
+            if self._supports_cursor(solr_client, query, search_params, unique_key):
+                yield from self._cursor_search(
+                    solr_client,
+                    query,
+                    search_params,
+                    unique_key,
+                    rows_per_batch,
+                    max_records,
+                    resume,
+                )
+                return
+            print("Cursor paging not supported by source; using offset paging.")
+
+        yield from self._offset_search(
+            solr_client, query, search_params, rows_per_batch, max_records, resume
+        )
+
+    def _search_page(
+        self, solr_client: Solr, query: str, search_params: dict
+    ) -> Results:
+        """Get one page of search results, retrying on errors."""
+        with metrics.timer("fetch"):
+            results = _retry_call(solr_client.search, query, **search_params)
+        metrics.count("source_docs", len(results.docs))
+        return results
+
+    def fetch_by_ids(
+        self, query: str, id_field: str, ids: list[str], **kwargs
     ) -> Generator[dict, Any, Any]:
-        solr_client = Solr(self.source_url, timeout=10)
+        # Each batch is usually a single page, so a cursor would only add a request.
+        return super().fetch_by_ids(
+            query, id_field, ids, **{**kwargs, "paging": "offset"}
+        )
+
+    def _get_unique_key(self) -> str:
+        """Get the uniqueKey field of the Solr core via the Schema API,
+        defaulting to "id" if that isn't available."""
+        schema_url = f"{self.source_url.rstrip('/')}/schema/uniquekey"
+        try:
+            response = requests.get(schema_url, params={"wt": "json"}, timeout=10)
+            response.raise_for_status()
+            return response.json().get("uniqueKey") or "id"
+        except (requests.RequestException, ValueError):
+            return "id"
+
+    def _supports_cursor(
+        self, solr_client: Solr, query: str, search_params: dict, unique_key: str
+    ) -> bool:
+        """Check whether the source can page through query with a cursor.
+
+        Only a request Solr rejects because of the cursor (e.g. when the
+        uniqueKey can't be sorted on) means it can't; other errors, like
+        timeouts, are retried as for any page.
+        """
+
+        def probe() -> bool:
+            try:
+                solr_client.search(
+                    query,
+                    **search_params,
+                    sort=f"{unique_key} asc",
+                    cursorMark="*",
+                    rows=0,
+                )
+            except SolrError as error:
+                if _rejects_cursor(error):
+                    return False
+                raise
+            return True
+
+        return _retry_call(probe)
+
+    def _cursor_search(
+        self,
+        solr_client: Solr,
+        query: str,
+        search_params: dict,
+        unique_key: str,
+        rows_per_batch: int,
+        max_records: int,
+        resume: dict | None = None,
+    ) -> Generator[tuple[list[dict], dict], Any, Any]:
+        if resume and "cursor_mark" not in resume:
+            raise ValueError("Can't resume an offset paging checkpoint with a cursor")
+        # Initialize the loop
+        cursor_mark = resume["cursor_mark"] if resume else "*"
+        fetched = resume["fetched"] if resume else 0
+        self._hits = max_records
+        while fetched < self._hits and fetched < max_records:
+            # Make sure final batch does not exceed max wanted.
+            rows = min(rows_per_batch, max_records - fetched)
+
+            results = self._search_page(
+                solr_client,
+                query,
+                {
+                    **search_params,
+                    "sort": f"{unique_key} asc",
+                    "cursorMark": cursor_mark,
+                    "rows": rows,
+                },
+            )
+            self._hits = results.hits
+            fetched += len(results.docs)
 
+            yield results.docs, {
+                "cursor_mark": results.nextCursorMark,
+                "fetched": fetched,
+            }
+
+            # Solr returns the same cursorMark once there are no more results.
+            if not results.docs or results.nextCursorMark == cursor_mark:
+                break
+            cursor_mark = results.nextCursorMark
+
+    def _offset_search(
+        self,
+        solr_client: Solr,
+        query: str,
+        search_params: dict,
+        rows_per_batch: int,
+        max_records: int,
+        resume: dict | None = None,
+    ) -> Generator[tuple[list[dict], dict], Any, Any]:
+        if resume and "start" not in resume:
+            # Offset pages are in a different order, so can't continue from a cursor.
+            raise ValueError("Can't resume a cursor paging checkpoint by offset")
         # Don't fetch more records per batch than max wanted.
         rows_per_batch = min(rows_per_batch, max_records)
         # Initialize the loop
-        start = 0
+        start = resume["start"] if resume else 0
         self._hits = max_records
         while start < self._hits and start < max_records:
             # Make sure final batch does not exceed max wanted.
             if start + rows_per_batch > max_records:
                 rows_per_batch = max_records - start
 
-            results = retry_call(
-                solr_client.search,
-                fargs=[query],
-                fkwargs={"defType": def_type, "start": start, "rows": rows_per_batch},
+            results = self._search_page(
+                solr_client,
+                query,
+                {**search_params, "start": start, "rows": rows_per_batch},
             )
             self._hits = results.hits
             start += rows_per_batch
 
-            for doc in results.docs:
-                yield doc
+            yield results.docs, {"start": start, "fetched": start}
 
-    def get_fields(self, def_type: str, *args, **kwargs) -> None:
-        """List all fields in all records of a Solr index,
-        along with the number of times they occur."""
-        source_solr = Solr(self.source_url, timeout=10, always_commit=True)
-        source_query = "*:*"
-        n_hits = float("inf")
-        max_records = float("inf")
-        start = 0
-        chunk_size = 250
-        all_keys = {}
-        while start < n_hits and start < max_records:
-            chunk = source_solr.search(
-                source_query, defType=def_type, start=start, rows=chunk_size
+    def get_fields(
+        self,
+        def_type: str = "lucene",
+        sample: int | None = None,
+        method: str = "scan",
+        **kwargs,
+    ) -> dict[str, int]:
+        """Count the number of records each field occurs in.
+
+        With method "luke", the counts Solr's Luke API already has are used
+        instead of reading every record (unless sampling). This only takes a
+        few seconds, but leaves out fields which are only stored, not indexed
+        (e.g. *_ssm), so it isn't the default.
+        """
+        if method == "luke" and not sample:
+            field_counts = self._get_luke_field_counts()
+            if field_counts is None:
+                raise NotImplementedError("Luke API not available for this source")
+            return field_counts
+        return super().get_fields(def_type=def_type, sample=sample, **kwargs)
+
+    def _get_luke_field_counts(self) -> dict[str, int] | None:
+        """Get the number of documents with each field from the Luke API,
+        or None if it's not available."""
+        luke_url = f"{self.source_url.rstrip('/')}/admin/luke"
+        try:
+            response = requests.get(
+                luke_url, params={"numTerms": 0, "wt": "json"}, timeout=60
             )
-            n_hits = chunk.hits
-            for doc in chunk.docs:
-                for key in doc.keys():
-                    if key in all_keys.keys():
-                        all_keys[key] = all_keys[key] + 1
-                    else:
-                        all_keys[key] = 1
-            start += chunk_size
-        pprint(dict(sorted(all_keys.items())), width=132)
-
-
-class FronteraSearch(BaseSearch):
+            response.raise_for_status()
+            fields = response.json()["fields"]
+        except (requests.RequestException, ValueError, KeyError):
+            return None
+        return {
+            name: info["docs"]
+            for name, info in fields.items()
+            if info.get("docs") is not None
+        }
+
+
+class FronteraSearch(HttpSearch):
+    modified_field = "ds_changed"
+    capabilities = HttpSearch.capabilities | {FIELD_PROJECTION, ID_LOOKUP}
+    items_path = ("response", "docs")
+
+    def _page_url(self, query: str, start: int, rows: int, extra_params: str) -> str:
+        return (
+            f"{self.source_url}?"
+            f"query={query}&start={start}&rows={rows}&wt=json{extra_params}"
+        )
+
+    def _parse_page(self, response: dict) -> tuple[list[dict], int]:
+        data = response.get("response")
+        return data.get("docs"), data.get("numFound")
+
+    def _fields_params(self, fields: list[str] | None) -> str:
+        # Only return the given fields, if any; by default all are returned.
+        if fields:
+            return f"&fl={quote(','.join(fields))}"
+        return ""
+
+
+class FileSearch(BaseSearch):
+    """Replays records saved by the dump command, from a local dump directory
+    (given as the source URL), instead of fetching them from the source again.
+
+    The dump's records are returned as they were saved, whatever the query;
+    since and fields are applied to each record. Chunks are read independently,
+    so workers can each replay their own slice of chunks.
+    """
+
+    capabilities = frozenset({FIELD_PROJECTION, PARALLEL_SLICES, ID_LOOKUP})
+
     def __init__(self, source_url: str):
         self.source_url = source_url
+        self.manifest = read_manifest(source_url)
         self._hits: int = 0
+        # Records have the same modification date field as in their source.
+        self.modified_field = get_driver(self.manifest["source_type"]).modified_field
 
     @property
     def hits(self) -> int:
-        # This will be the initial 0 until search results
-        # start being evaluated by the caller.
         return self._hits
 
-    def search(
+    def search_pages(
         self,
         query: str,
         rows_per_batch: int = 1000,
         max_records: int = 999_999_999,
+        partition: tuple[int, int] | None = None,
+        since: str | None = None,
+        modified_field: str | None = None,
+        fields: list[str] | None = None,
+        resume: dict | None = None,
         **kwargs,
-    ) -> Generator[dict, Any, Any]:
-
-        rows_per_batch = min(rows_per_batch, max_records)
-        # Initialize the loop
-        start = 0
-        self._hits = max_records
-        while start < self._hits and start < max_records:
-            # Make sure final batch does not exceed max wanted.
-            if start + rows_per_batch > max_records:
-                rows_per_batch = max_records - start
-
-            query_url = (
-                f"{self.source_url}?"
-                f"query={query}&start={start}&rows={rows_per_batch}&wt=json"
+    ) -> Generator[tuple[list[dict], dict], Any, Any]:
+        if query not in (self.default_query, self.manifest["query"]):
+            print(f"Replaying dump of query {self.manifest['query']!r}, not {query!r}.")
+        chunks = self.manifest["chunks"]
+        # partition is (worker, workers): replay every workers-th chunk.
+        if partition:
+            worker, workers = partition
+            chunks = chunks[worker::workers]
+        if since:
+            modified_field = self.get_modified_field(modified_field)
+        self._hits = sum(chunk["records"] for chunk in chunks)
+
+        # Positions are a chunk (of this partition) and a line in it.
+        first_chunk = resume["chunk"] if resume else 0
+        skip_lines = resume["line"] if resume else 0
+        returned = resume["fetched"] if resume else 0
+        for chunk_number in range(first_chunk, len(chunks)):
+            lines = read_chunk(
+                self.source_url, chunks[chunk_number]["file"], decoders.loads
             )
-            results = retry_call(requests.get, fargs=[query_url])
-            data = results.json().get("response")
-            self._hits = data.get("numFound")
-            start += rows_per_batch
-
-            docs = data.get("docs")
-            for doc in docs:
+            line = skip_lines if chunk_number == first_chunk else 0
+            lines = islice(lines, line, None)
+            while returned < max_records and (
+                batch := _timed_batch(
+                    lines, min(rows_per_batch, max_records - returned)
+                )
+            ):
+                line += len(batch)
+                docs = [
+                    (
+                        {field: doc[field] for field in fields if field in doc}
+                        if fields
+                        else doc
+                    )
+                    for doc in batch
+                    # ISO 8601 UTC timestamps sort the same as strings.
+                    if not since or str(doc.get(modified_field, "")) >= since
+                ]
+                returned += len(docs)
+                yield docs, {"chunk": chunk_number, "line": line, "fetched": returned}
+            if returned >= max_records:
+                return
+
+    def fetch_by_ids(
+        self, query: str, id_field: str, ids: list[str], **kwargs
+    ) -> Generator[dict, Any, Any]:
+        """Find the records with the given ids by reading the whole dump."""
+        wanted = set(ids)
+        for doc in self.search(query, **kwargs):
+            if str(doc.get(id_field)) in wanted:
                 yield doc
-
-    def get_fields(self, *args, **kwargs):
-        rows_per_batch = 1000
-        max_records = 999_999_999
-        query = "*:*"
-        all_keys = {}
-        # Initialize the loop
-        start = 0
-        self._hits = max_records
-        while start < self._hits and start < max_records:
-            # Make sure final batch does not exceed max wanted.
-            if start + rows_per_batch > max_records:
-                rows_per_batch = max_records - start
-
-            query_url = (
-                f"{self.source_url}?"
-                f"query={query}&start={start}&rows={rows_per_batch}&wt=json"
-            )
-            results = retry_call(requests.get, fargs=[query_url])
-            data = results.json().get("response")
-            self._hits = data.get("numFound")
-            start += rows_per_batch
-
-            docs = data.get("docs")
-            for doc in docs:
-                for key in doc.keys():
-                    if key in all_keys.keys():
-                        all_keys[key] = all_keys[key] + 1
-                    else:
-                        all_keys[key] = 1
-        pprint(dict(sorted(all_keys.items())), width=132)
@@ -0,0 +1,250 @@
+"""Decoding JSON responses from sources, and encoding documents.
+
+loads is the fastest JSON decoder installed: orjson, then msgspec, falling back
+to the standard library's json, unless $CENTRALSEARCH_JSON_DECODER names one of
+DECODERS. Decoded values are the same whichever is used. dumps encodes with
+the same library, as compact UTF-8; values JSON has no type for (e.g. dates)
+are encoded as strings.
+
+iter_json_items parses a response as it arrives, rather than after reading all
+of it, e.g. for pages of records with large full-text fields:
+
+    envelope = {}
+    chunks = response.iter_content(CHUNK_SIZE)
+    for doc in iter_json_items(chunks, ("data", "items"), envelope):
+        ...
+"""
+
+import codecs
+import json
+import os
+import re
+from functools import partial
+from typing import Any, Callable, Generator, Iterable
+
+# Bytes of a response read at a time by iter_json_items.
+CHUNK_SIZE = 64 * 1024
+
+
+def _json_dumps(value: Any) -> bytes:
+    return json.dumps(
+        value, ensure_ascii=False, separators=(",", ":"), default=str
+    ).encode()
+
+
+def _libraries() -> dict[str, tuple[Callable[[str | bytes], Any], Callable]]:
+    """Get the installed JSON libraries' (decode, encode) functions, fastest first."""
+    libraries = {}
+    try:
+        import orjson
+
+        libraries["orjson"] = (
+            orjson.loads,
+            partial(orjson.dumps, default=str, option=orjson.OPT_NON_STR_KEYS),
+        )
+    except ImportError:
+        pass
+    try:
+        import msgspec
+
+        libraries["msgspec"] = (
+            msgspec.json.decode,
+            msgspec.json.Encoder(enc_hook=str).encode,
+        )
+    except ImportError:
+        pass
+    libraries["json"] = (json.loads, _json_dumps)
+    return libraries
+
+
+DECODERS = _libraries()
+DECODER = os.environ.get("CENTRALSEARCH_JSON_DECODER") or next(iter(DECODERS))
+if DECODER not in DECODERS:
+    raise ValueError(f"JSON decoder {DECODER} is not installed")
+# Decode a JSON document, from str or (UTF-8) bytes.
+loads: Callable[[str | bytes], Any] = DECODERS[DECODER][0]
+# Encode a value as compact JSON, in UTF-8 bytes.
+dumps: Callable[[Any], bytes] = DECODERS[DECODER][1]
+
+_NOT_SPACE = re.compile(r"\S")
+_raw_decode = json.JSONDecoder().raw_decode
+# Characters which matter when looking for the end of a value: in arrays and
+# objects, in strings, and after numbers, true, false or null.
+_STRUCTURE = re.compile(r'["\[\]{}]')
+# The rest of a string, up to its closing quote or a backslash at the end.
+_STRING_BODY = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*', re.DOTALL)
+_SCALAR_END = re.compile(r"[\s,\]}]")
+
+
+class _ValueEnd:
+    """Finds where a JSON value ends in text arriving in pieces, scanning each
+    piece once, so the value can then be decoded in one go."""
+
+    def __init__(self, first: str):
+        self.scalar = first not in '{["'
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+
+    def find(self, text: str, pos: int) -> int | None:
+        """Scan text from pos, returning where the value ends, or None if it
+        continues after the end of text."""
+        if self.scalar:
+            match = _SCALAR_END.search(text, pos)
+            return match.start() if match else None
+        while True:
+            if self.escaped:
+                if pos >= len(text):
+                    return None
+                pos += 1
+                self.escaped = False
+            if self.in_string:
+                quote = text.find('"', pos)
+                if text.find("\\", pos, len(text) if quote < 0 else quote) < 0:
+                    # Nothing escaped, as in most strings: skip to the quote.
+                    pos = len(text) if quote < 0 else quote
+                else:
+                    pos = _STRING_BODY.match(text, pos).end()
+                if pos == len(text):
+                    return None
+                if text[pos] == "\\":
+                    # The escaped character is in the next piece.
+                    self.escaped = True
+                    pos += 1
+                    continue
+                pos += 1
+                self.in_string = False
+                if self.depth == 0:
+                    return pos
+                continue
+            match = _STRUCTURE.search(text, pos)
+            if not match:
+                return None
+            pos = match.end()
+            character = match.group()
+            if character == '"':
+                self.in_string = True
+            elif character in "[{":
+                self.depth += 1
+            else:
+                self.depth -= 1
+                if self.depth == 0:
+                    return pos
+
+
+class _StreamReader:
+    """Reads JSON values one at a time from text arriving in chunks of bytes,
+    keeping only the text not yet read."""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._done = False
+        self.text = ""
+        self.pos = 0
+
+    def _read_more(self) -> bool:
+        """Add the next chunk to the text; False if there's no more."""
+        if self._done:
+            return False
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._done = True
+            more = self._decoder.decode(b"", final=True)
+        else:
+            more = self._decoder.decode(chunk)
+        self.text = self.text[self.pos :] + more
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Skip whitespace, and get the next character without reading it."""
+        while True:
+            match = _NOT_SPACE.search(self.text, self.pos)
+            if match:
+                self.pos = match.start()
+                return self.text[self.pos]
+            self.pos = len(self.text)
+            if not self._read_more():
+                raise ValueError("Unexpected end of JSON")
+
+    def expect(self, characters: str) -> str:
+        """Read the next character, which must be one of characters."""
+        character = self.peek()
+        if character not in characters:
+            raise ValueError(
+                f"Expected one of {characters!r} in JSON, not {character!r}"
+            )
+        self.pos += 1
+        return character
+
+    def value(self) -> Any:
+        """Read and decode the next value."""
+        first = self.peek()
+        if first in '{["':
+            # Most values are complete in the text already read, so try that first.
+            try:
+                value, self.pos = _raw_decode(self.text, self.pos)
+                return value
+            except json.JSONDecodeError:
+                pass
+        # Otherwise read until the end of the value (once), then decode it.
+        value_end = _ValueEnd(first)
+        # Text of a value longer than what's been read, in the order read.
+        pieces = []
+        start = self.pos
+        while (end := value_end.find(self.text, start)) is None:
+            pieces.append(self.text[self.pos :])
+            self.text = ""
+            self.pos = start = 0
+            if not self._read_more():
+                if not value_end.scalar:
+                    raise ValueError("Unexpected end of JSON")
+                # A number, true, false or null at the very end.
+                end = 0
+                break
+        pieces.append(self.text[self.pos : end])
+        self.pos = end
+        return loads("".join(pieces))
+
+
+def iter_json_items(
+    chunks: Iterable[bytes], path: tuple[str, ...], envelope: dict | None = None
+) -> Generator[Any, Any, Any]:
+    """Parse a JSON object arriving in chunks of bytes, yielding each item of
+    the array at path (keys of nested objects) as soon as it has arrived.
+
+    Everything else in the object is added to envelope, e.g. the number of
+    hits, which is there when the first item is yielded if it comes before
+    the array in the response. Only about one item is held in memory at a time.
+    """
+    reader = _StreamReader(chunks)
+    yield from _parse_object(reader, path, {} if envelope is None else envelope)
+
+
+def _parse_object(
+    reader: _StreamReader, path: tuple[str, ...], envelope: dict
+) -> Generator[Any, Any, Any]:
+    reader.expect("{")
+    if reader.peek() == "}":
+        reader.pos += 1
+        return
+    while True:
+        key = reader.value()
+        reader.expect(":")
+        if key == path[0] and len(path) == 1 and reader.peek() == "[":
+            reader.pos += 1
+            if reader.peek() == "]":
+                reader.pos += 1
+            else:
+                while True:
+                    yield reader.value()
+                    if reader.expect(",]") == "]":
+                        break
+        elif key == path[0] and len(path) > 1 and reader.peek() == "{":
+            envelope[key] = {}
+            yield from _parse_object(reader, path[1:], envelope[key])
+        else:
+            envelope[key] = reader.value()
+        if reader.expect(",}") == "}":
+            return
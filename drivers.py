@@ -0,0 +1,88 @@
+"""Registry of source drivers: the searcher class for each source type.
+
+Built-in drivers are in datasources.py. Other packages can add drivers for new
+types of source, without changes here, by declaring an entry point in the
+centralsearch.drivers group, named for the source type, e.g. in pyproject.toml:
+
+    [project.entry-points."centralsearch.drivers"]
+    oai = "oai_driver:OaiSearch"
+
+A driver is a subclass of datasources.BaseSearch, which lists what it can do
+in its capabilities (see below); copy uses them to choose how to harvest.
+
+Drivers are only imported when a source of their type is used, so the CLI
+starts quickly, and commands which don't use a source (or Elasticsearch) don't
+load requests, pysolr or elasticsearch at all.
+"""
+
+from functools import cache
+from importlib import import_module
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from datasources import BaseSearch
+
+ENTRY_POINT_GROUP = "centralsearch.drivers"
+
+# Capabilities of drivers.
+# Pages through results with a cursor, which stays fast however deep it goes.
+CURSOR_PAGING = "cursor_paging"
+# Fetches only the fields asked for (the profile's SOURCE_FIELDS).
+FIELD_PROJECTION = "field_projection"
+# Fetches several pages at the same time.
+PREFETCH = "prefetch"
+# Splits results into disjoint slices (partition), for parallel workers.
+PARALLEL_SLICES = "parallel_slices"
+# Fetches records by id (fetch_by_ids), for copy --id and retry_failed.
+ID_LOOKUP = "id_lookup"
+# Counts fields without reading every record (get_fields --method luke).
+FIELD_COUNTS = "field_counts"
+
+# Source type: "module:class" of its searcher.
+BUILTIN_DRIVERS = {
+    "solr": "datasources:SolrSearch",
+    "dataverse": "datasources:DataverseSearch",
+    "frontera": "datasources:FronteraSearch",
+    "file": "datasources:FileSearch",
+}
+
+
+@cache
+def registry() -> dict[str, str]:
+    """Get all drivers: the built-in ones, and any installed as entry points."""
+    # Imported here, since finding entry points takes longer than starting the CLI.
+    from importlib.metadata import entry_points
+
+    drivers = dict(BUILTIN_DRIVERS)
+    for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+        drivers[entry_point.name] = entry_point.value
+    return drivers
+
+
+def source_types() -> tuple[str, ...]:
+    return tuple(registry())
+
+
+@cache
+def get_driver(source_type: str) -> type["BaseSearch"]:
+    """Import and return the searcher class for a type of data source."""
+    if source_type not in registry():
+        raise NotImplementedError(f"Unsupported {source_type=}")
+    module_name, class_name = registry()[source_type].split(":")
+    driver = getattr(import_module(module_name), class_name)
+
+    from datasources import BaseSearch
+
+    if not issubclass(driver, BaseSearch):
+        raise TypeError(f"Driver for {source_type} is not a BaseSearch")
+    return driver
+
+
+def supports(source_type: str, capability: str) -> bool:
+    """Check whether the driver for a type of data source has a capability."""
+    return capability in get_driver(source_type).capabilities
+
+
+def get_searcher(source_type: str, source_url: str) -> "BaseSearch":
+    """Get the searcher for a type of data source."""
+    return get_driver(source_type)(source_url)
@@ -0,0 +1,94 @@
+import gzip
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Generator, Iterable
+from urllib.parse import urlsplit, urlunsplit
+
+# A dump is a directory of gzipped NDJSON chunks (one source record per line)
+# and a manifest.json describing them:
+# {
+#     "source_url": "https://example.edu/solr/core",
+#     "source_type": "solr",
+#     "query": "*:*",
+#     "started": "2024-01-31T08:00:00Z",
+#     "hits": 25000,
+#     "records": 25000,
+#     "chunks": [{"file": "chunk-00000.ndjson.gz", "records": 10000}, ...]
+# }
+MANIFEST = "manifest.json"
+CHUNK_SIZE = 10_000
+# Dumps are written once and read many times, so favour write speed over size.
+COMPRESS_LEVEL = 3
+
+
+def chunk_name(chunk: int) -> str:
+    return f"chunk-{chunk:05d}.ndjson.gz"
+
+
+def strip_credentials(url: str) -> str:
+    """Remove any username and password from a URL, so they aren't saved."""
+    parts = urlsplit(url)
+    if "@" not in parts.netloc:
+        return url
+    return urlunsplit(parts._replace(netloc=parts.netloc.rsplit("@", 1)[1]))
+
+
+def write_chunk(dump_dir: Path, chunk: int, docs: Iterable[dict]) -> dict:
+    """Write one chunk of records, returning its manifest entry."""
+    name = chunk_name(chunk)
+    tmp_path = dump_dir / f"{name}.tmp"
+    records = 0
+    with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=COMPRESS_LEVEL) as f:
+        for doc in docs:
+            f.write(json.dumps(doc, ensure_ascii=False, separators=(",", ":")))
+            f.write("\n")
+            records += 1
+    os.replace(tmp_path, dump_dir / name)
+    return {"file": name, "records": records}
+
+
+def write_manifest(
+    dump_dir: Path,
+    source_url: str,
+    source_type: str,
+    query: str,
+    started: datetime,
+    hits: int,
+    chunks: list[dict],
+) -> None:
+    """Write the manifest last, so a dump is only usable once it's complete."""
+    # Imported here, since the CLI imports this module at startup.
+    from state import format_timestamp
+
+    manifest = {
+        "source_url": strip_credentials(source_url),
+        "source_type": source_type,
+        "query": query,
+        "started": format_timestamp(started),
+        "hits": hits,
+        "records": sum(chunk["records"] for chunk in chunks),
+        "chunks": chunks,
+    }
+    tmp_path = dump_dir / f"{MANIFEST}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, dump_dir / MANIFEST)
+
+
+def read_manifest(dump_dir: str | Path) -> dict:
+    manifest_path = Path(dump_dir) / MANIFEST
+    if not manifest_path.exists():
+        raise ValueError(f"{dump_dir} is not a complete dump: no {MANIFEST}")
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def read_chunk(
+    dump_dir: str | Path, name: str, loads: Callable[[str], Any] = json.loads
+) -> Generator[dict, Any, Any]:
+    """Read the records in a chunk of a dump, decoding each with loads."""
+    with gzip.open(Path(dump_dir) / name, "rt", encoding="utf-8") as f:
+        for line in f:
+            yield loads(line)
@@ -0,0 +1,1071 @@
+import json
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from importlib import import_module
+from itertools import islice
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Callable, Generator, Iterable
+
+from elasticsearch import Elasticsearch, NotFoundError
+from elasticsearch.helpers import scan, streaming_bulk
+import metrics
+from bulk import BulkSizer, bulk_load, limit_requests, request_slots
+from drivers import CURSOR_PAGING, PARALLEL_SLICES, get_driver, get_searcher
+from dumps import (
+    CHUNK_SIZE,
+    read_manifest,
+    strip_credentials,
+    write_chunk,
+    write_manifest,
+)
+from indexes import (
+    create_versioned_index,
+    finish_versioned_index,
+    put_index_template,
+    swap_alias,
+)
+from sinks import open_sink
+from state import (
+    Checkpoint,
+    DeadLetters,
+    HashStore,
+    checkpoint_suffix,
+    content_hash,
+    delete_checkpoints,
+    delete_dead_letters,
+    format_timestamp,
+    has_hash_store,
+    load_checkpoints,
+    load_dead_letters,
+    load_state,
+    save_high_water_mark,
+)
+
+# Maximum number of batches waiting between pipeline stages.
+QUEUE_SIZE = 4
+# Seconds between metrics log lines.
+METRICS_INTERVAL = 10
+# Worker processes for sources which can be split into slices, unless given.
+AUTO_WORKERS = 4
+# Default max_records: no limit.
+ALL_RECORDS = 999_999_999
+
+
+@dataclass
+class CopyResult:
+    """Counts from copying (part of) a source index."""
+
+    completed: int = 0
+    errors: int = 0
+    hits: int = 0
+    unchanged: int = 0
+    # Snapshot of the copy's metrics; see metrics.Metrics.snapshot.
+    metrics: dict | None = None
+
+    def __add__(self, other: "CopyResult") -> "CopyResult":
+        return CopyResult(
+            completed=self.completed + other.completed,
+            errors=self.errors + other.errors,
+            hits=self.hits + other.hits,
+            unchanged=self.unchanged + other.unchanged,
+            metrics=metrics.merge_snapshots(self.metrics, other.metrics),
+        )
+
+
+class CopyOptionsError(ValueError):
+    """Raised for options a copy can't be made with, which retrying won't fix."""
+
+
+class PipelineStopped(Exception):
+    """Raised inside a pipeline stage when another stage has failed."""
+
+
+class Pipeline:
+    """Runs stages in threads, connected by bounded queues.
+
+    Each stage is a function which reads batches from its input queue (via get)
+    and writes batches to its output queue (via put). Bounded queues let the stages
+    overlap while keeping memory use in check: a stage which gets ahead of the next
+    one just waits. If any stage fails, all others are stopped and the first error
+    is raised by join.
+    """
+
+    DONE = object()
+
+    def __init__(self) -> None:
+        self._stop = threading.Event()
+        self._errors: list[BaseException] = []
+        self._threads: list[threading.Thread] = []
+
+    def new_queue(self, maxsize: int = QUEUE_SIZE) -> queue.Queue:
+        return queue.Queue(maxsize=maxsize)
+
+    def start(self, stage: Callable, *args) -> None:
+        def _run() -> None:
+            try:
+                stage(*args)
+            except PipelineStopped:
+                pass
+            except BaseException as e:
+                self._errors.append(e)
+                self._stop.set()
+
+        thread = threading.Thread(target=_run, name=stage.__name__, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def put(self, q: queue.Queue, item: Any) -> None:
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+        raise PipelineStopped()
+
+    def get(self, q: queue.Queue) -> Any:
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        raise PipelineStopped()
+
+    def iterate(self, q: queue.Queue) -> Generator[Any, Any, Any]:
+        """Yield items from q until DONE is received."""
+        while (item := self.get(q)) is not self.DONE:
+            yield item
+
+    def join(self) -> None:
+        try:
+            for thread in self._threads:
+                while thread.is_alive():
+                    thread.join(timeout=0.1)
+        finally:
+            # Stop any remaining stages if interrupted.
+            self._stop.set()
+        if self._errors:
+            raise self._errors[0]
+
+
+def load_profile(profile: str | None) -> ModuleType | None:
+    """Import a mapping profile module (e.g. config.samvera) by name."""
+    return import_module(profile) if profile else None
+
+
+def get_es_client(elastic_url: str, elastic_api_key: str | None) -> Elasticsearch:
+    return Elasticsearch(
+        hosts=[elastic_url],
+        verify_certs=True,
+        api_key=elastic_api_key,
+    )
+
+
+def get_index_uuid(es_client: Elasticsearch, index_name: str) -> str | None:
+    """Get the uuid of an index (or of the index an alias points to),
+    or None if it doesn't exist yet."""
+    try:
+        settings = es_client.indices.get_settings(index=index_name, name="index.uuid")
+    except NotFoundError:
+        return None
+    # Only one index is expected; if an alias points to several, use them all.
+    return ",".join(
+        sorted(index["settings"]["index"]["uuid"] for index in settings.values())
+    )
+
+
+def _batched(items: Iterable, size: int) -> Generator[list, Any, Any]:
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def copy_records(
+    source_url: str,
+    source_type: str,
+    destination_index_name: str,
+    elastic_url: str,
+    elastic_api_key: str | None,
+    profile: str | None,
+    max_records: int = ALL_RECORDS,
+    partition: tuple[int, int] | None = None,
+    bulk_workers: int = 2,
+    skip_unchanged: bool = False,
+    checkpoint_name: str | None = None,
+    started: str | None = None,
+    resume: bool = False,
+    metrics_log: str | None = None,
+    sink: str = "elasticsearch",
+    output: str | None = None,
+    **search_kwargs,
+) -> CopyResult:
+    """Copy records from a source index to an Elasticsearch index, or another
+    sink (see sinks.py), e.g. a file with output as its path.
+
+    Fetching source records, mapping them and bulk loading them into Elasticsearch
+    run as separate pipeline stages, so each can work while the others wait on I/O;
+    bulk_workers sets the number of concurrent bulk loaders.
+
+    If skip_unchanged, a hash of each document loaded is saved locally, and
+    documents with the same hash as when they were last loaded are not sent
+    to Elasticsearch again.
+
+    If partition is given as (worker, workers), only that slice of the
+    source is copied; see copy_records_parallel.
+
+    Progress is checkpointed under checkpoint_name (the index name, or alias
+    for versioned copies) as it goes; if resume, the copy continues from
+    the last checkpoint, if there is one, adding to the sink's files.
+
+    Metrics are logged to the file metrics_log as JSON lines, if given.
+    """
+    profile_module = load_profile(profile)
+    get_id = getattr(profile_module, "get_id", lambda x: x["id"])
+    map_record = getattr(profile_module, "map_record", lambda x: x)
+    source_query = getattr(profile_module, "SOURCE_QUERY", "*:*")
+    modified_field = getattr(profile_module, "MODIFIED_FIELD", None)
+    source_fields = getattr(profile_module, "SOURCE_FIELDS", None)
+    id_fields = getattr(profile_module, "ID_FIELDS", ["id"])
+    label = f"[worker {partition[0]}] " if partition else ""
+    metrics.REGISTRY.reset()
+
+    searcher = get_searcher(source_type, source_url)
+
+    checkpoint_name = checkpoint_name or destination_index_name
+    run = {
+        "source_url": strip_credentials(source_url),
+        "source_type": source_type,
+        "profile": profile,
+        "query": source_query,
+        "since": search_kwargs.get("since"),
+        "paging": search_kwargs.get("paging"),
+        "partition": list(partition) if partition else None,
+        "index": destination_index_name,
+        "started": started,
+    }
+    resume_from = None
+    if resume:
+        resume_from = load_state(checkpoint_name, checkpoint_suffix(partition))
+        for key, value in run.items():
+            if key != "started" and resume_from.get(key, value) != value:
+                raise CopyOptionsError(
+                    f"Can't resume: the last copy into {checkpoint_name} had "
+                    f"{key} {resume_from[key]!r}, not {value!r}"
+                )
+        run["started"] = resume_from.get("started", started)
+    checkpoint = Checkpoint(checkpoint_name, partition, run, resume_from)
+    if checkpoint.position:
+        print(f"{label}Resuming after {checkpoint.position['fetched']} records")
+
+    rows_per_batch = 1000
+    pages = searcher.search_pages(
+        source_query,
+        rows_per_batch=rows_per_batch,
+        max_records=max_records,
+        partition=partition,
+        modified_field=modified_field,
+        fields=source_fields,
+        resume=checkpoint.position,
+        **search_kwargs,
+    )
+
+    es_client = None
+    if sink == "elasticsearch":
+        es_client = get_es_client(elastic_url, elastic_api_key)
+    output_sink = open_sink(
+        sink, destination_index_name, output, partition, es_client, append=resume
+    )
+
+    hash_store = None
+    if skip_unchanged:
+        hash_store = HashStore(
+            destination_index_name, get_index_uuid(es_client, destination_index_name)
+        )
+
+    pipeline = Pipeline()
+    source_batches = pipeline.new_queue()
+    es_batches = pipeline.new_queue()
+    result = CopyResult(
+        completed=checkpoint.completed,
+        errors=checkpoint.errors,
+        unchanged=checkpoint.unchanged,
+    )
+    result_lock = threading.Lock()
+    dead_letters = DeadLetters(checkpoint_name, partition)
+    # Documents being loaded, by _id, with their source page (for the checkpoint),
+    # source id fields (for dead letters) and hash (saved once loaded, if
+    # skip_unchanged). Several source records can have the same _id.
+    in_flight: dict[str, deque[tuple[int, dict, dict, bytes | None]]] = defaultdict(
+        deque
+    )
+
+    def _skip_unchanged(
+        es_docs: list[dict], source_ids: list[dict], page: int
+    ) -> tuple[list[dict], list[dict], list[bytes]]:
+        """Remove documents which haven't changed since they were last loaded,
+        returning those left, their source ids and their hashes."""
+        saved_hashes = hash_store.get_many([es_doc["_id"] for es_doc in es_docs])
+        changed = ([], [], [])
+        for es_doc, source_id in zip(es_docs, source_ids):
+            doc_hash = content_hash(es_doc)
+            if saved_hashes.get(es_doc["_id"]) != doc_hash:
+                changed[0].append(es_doc)
+                changed[1].append(source_id)
+                changed[2].append(doc_hash)
+        unchanged = len(es_docs) - len(changed[0])
+        with result_lock:
+            result.unchanged += unchanged
+        checkpoint.acknowledge(page, unchanged, unchanged=unchanged)
+        return changed
+
+    def fetch() -> None:
+        """Fetch source records, a page at a time."""
+        for batch, position in pages:
+            page = checkpoint.add_page(position, len(batch))
+            pipeline.put(source_batches, (page, batch))
+        pipeline.put(source_batches, pipeline.DONE)
+
+    def map_docs() -> None:
+        """Map pages of source records to Elasticsearch documents."""
+        for page, batch in pipeline.iterate(source_batches):
+            es_docs = []
+            source_ids = []
+            with metrics.timer("map"):
+                for doc in batch:
+                    es_doc = map_record(doc)
+                    # Explicitly set _id, used by bulk_load for each record.
+                    es_doc["_id"] = get_id(es_doc)
+                    es_docs.append(es_doc)
+                    source_ids.append({field: doc.get(field) for field in id_fields})
+            metrics.count("mapped_docs", len(es_docs))
+            hashes = [None] * len(es_docs)
+            if hash_store:
+                es_docs, source_ids, hashes = _skip_unchanged(es_docs, source_ids, page)
+            pipeline.put(es_batches, (page, es_docs, source_ids, hashes))
+        # Tell each bulk loader there's nothing more to load.
+        for _ in range(bulk_workers):
+            pipeline.put(es_batches, pipeline.DONE)
+
+    def _generate_docs() -> Generator[dict, Any, Any]:
+        """Generator for use by bulk_load."""
+        for page, batch, source_ids, hashes in pipeline.iterate(es_batches):
+            with result_lock:
+                for es_doc, source_id, doc_hash in zip(batch, source_ids, hashes):
+                    in_flight[es_doc["_id"]].append((page, source_id, es_doc, doc_hash))
+            yield from batch
+
+    def load() -> None:
+        """Load documents into Elasticsearch in bulk (or write them to the sink)."""
+        # https://elasticsearch-py.readthedocs.io/en/7.x/helpers.html
+        # Example result (success):
+        # {
+        #     "index": {
+        #         "_index": "central-search-calursus",
+        #         "_type": "_doc",
+        #         "_id": "https://digital.library.ucla.edu/catalog/ark:/21198/z1n88f1d/hz014895",
+        #         "_version": 4,
+        #         "result": "updated",
+        #         "_shards": {"total": 2, "successful": 2, "failed": 0},
+        #         "_seq_no": 2504626,
+        #         "_primary_term": 1,
+        #         "status": 200,
+        #     }
+        # }
+        loaded_hashes = []
+        for ok, item in output_sink.write(_generate_docs()):
+            doc_id = item["index"]["_id"]
+            with result_lock:
+                page, source_id, es_doc, doc_hash = in_flight[doc_id].popleft()
+                if not in_flight[doc_id]:
+                    del in_flight[doc_id]
+            if not ok:
+                dead_letters.add(
+                    doc_id,
+                    source_id,
+                    item["index"].get("error"),
+                    {key: value for key, value in es_doc.items() if key != "_id"},
+                )
+            checkpoint.acknowledge(
+                page, completed=int(ok), failed_id=None if ok else doc_id
+            )
+            metrics.count("loaded_docs" if ok else "failed_docs")
+            if ok and hash_store:
+                loaded_hashes.append((doc_id, doc_hash))
+                if len(loaded_hashes) >= rows_per_batch:
+                    hash_store.set_many(loaded_hashes)
+                    loaded_hashes = []
+            with result_lock:
+                # ok is a boolean.
+                if ok:
+                    # True = 1, so increment completed.
+                    result.completed += ok
+                    done = result.completed + result.unchanged
+                    total = min(searcher.hits, max_records)
+                    if (result.completed % rows_per_batch == 0) or (done == total):
+                        print(f"{label}{done} / {total}")
+                else:
+                    # Something went wrong; since this is unpredictable, print the
+                    # whole result message, which includes index, record id, and
+                    # error info including the specific field and data causing
+                    # the problem.
+                    result.errors += 1
+                    print(f"{label}ERROR: {item}")
+        if loaded_hashes:
+            hash_store.set_many(loaded_hashes)
+
+    pipeline.start(fetch)
+    pipeline.start(map_docs)
+    for _ in range(bulk_workers):
+        pipeline.start(load)
+    try:
+        with metrics.report_periodically(
+            metrics_log,
+            METRICS_INTERVAL,
+            index=destination_index_name,
+            worker=partition[0] if partition else 0,
+        ):
+            pipeline.join()
+    finally:
+        output_sink.close()
+        checkpoint.save()
+        dead_letters.flush()
+        if hash_store:
+            hash_store.close()
+
+    result.hits = searcher.hits
+    result.metrics = metrics.REGISTRY.snapshot()
+    return result
+
+
+def copy_records_parallel(workers: int, **copy_kwargs) -> CopyResult:
+    """Copy records with several worker processes, each harvesting, mapping and
+    loading its own disjoint slice of the source index."""
+    # Workers share any limit on bulk requests this process has.
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=limit_requests,
+        initargs=(request_slots(),),
+    ) as executor:
+        futures = [
+            executor.submit(
+                copy_records,
+                partition=(worker, workers),
+                **copy_kwargs,
+            )
+            for worker in range(workers)
+        ]
+        # Wait for all workers, raising the first error from any of them.
+        results = [future.result() for future in futures]
+    return sum(results, CopyResult())
+
+
+def plan_copy(
+    source_type: str, workers: int | None = None, paging: str | None = None
+) -> dict:
+    """Choose the fastest way to copy from a type of source, from what its driver
+    can do, for the options not given: cursor paging if it has it (otherwise
+    offset paging, which drivers with prefetch speed up by fetching several
+    pages at once), and AUTO_WORKERS worker processes if the source can be
+    split into slices."""
+    driver = get_driver(source_type)
+    if workers is None:
+        workers = (
+            min(AUTO_WORKERS, os.cpu_count() or 1)
+            if PARALLEL_SLICES in driver.capabilities
+            else 1
+        )
+    elif workers > 1 and PARALLEL_SLICES not in driver.capabilities:
+        raise CopyOptionsError(
+            f"{source_type} sources can't be copied by parallel workers"
+        )
+    if paging is None:
+        paging = "cursor" if CURSOR_PAGING in driver.capabilities else "offset"
+    return {"workers": workers, "paging": paging}
+
+
+def copy_checkpoint_name(destination_index_name: str, sink: str) -> str:
+    """Get the name checkpoints and failures of a copy are saved under."""
+    if sink == "elasticsearch":
+        return destination_index_name
+    return f"{destination_index_name}.{sink}"
+
+
+def run_copy(
+    destination_index_name: str,
+    elastic_url: str | None,
+    elastic_api_key: str | None,
+    max_records: int = ALL_RECORDS,
+    workers: int | None = None,
+    versioned: bool = False,
+    keep_versions: int = 2,
+    resume: bool = False,
+    metrics_textfile: str | None = None,
+    metrics_pushgateway: str | None = None,
+    sink: str = "elasticsearch",
+    apply_template: str | None = None,
+    **copy_kwargs,
+) -> CopyResult:
+    """Copy records from a source index to an Elasticsearch index, with the given
+    number of worker processes.
+
+    With another sink (see sinks.py), documents are written for the index,
+    e.g. to the file given as the output copy argument, without Elasticsearch.
+    Checkpoints and failures of such copies are kept separately from those of
+    copies into the index, and they don't affect copy --since last.
+
+    If versioned, destination_index_name is an alias: records are copied into a new
+    index, with settings tuned for bulk loading, and the alias is moved to it once
+    the copy is done. Searches using the alias are not affected by the copy.
+
+    If workers (or the paging copy argument) is None, it's chosen by plan_copy
+    from what the source's driver can do.
+
+    If resume, an interrupted copy (including into a versioned index) continues
+    from its last checkpoint; otherwise any checkpoint is discarded.
+
+    apply_template is a file with an index template made by make_template
+    (see templates.py), which is put before copying, so that it applies when
+    the index (or the new versioned index) is created.
+
+    Metrics for the whole copy are written to metrics_textfile and sent to
+    metrics_pushgateway in Prometheus format, if given, and logged to the
+    metrics_log copy argument.
+    """
+    started = datetime.now(timezone.utc)
+    to_elasticsearch = sink == "elasticsearch"
+    checkpoint_name = copy_checkpoint_name(destination_index_name, sink)
+    copy_kwargs.update(
+        elastic_url=elastic_url,
+        elastic_api_key=elastic_api_key,
+        max_records=max_records,
+        destination_index_name=destination_index_name,
+        checkpoint_name=checkpoint_name,
+        resume=resume,
+        sink=sink,
+    )
+
+    es_client = None
+    if to_elasticsearch:
+        es_client = get_es_client(elastic_url, elastic_api_key)
+    elif versioned or copy_kwargs.get("skip_unchanged") or apply_template:
+        raise CopyOptionsError(
+            "versioned, skip_unchanged and apply_template copies can only be "
+            "into Elasticsearch"
+        )
+    if sink == "stdout":
+        # Workers' output would be interleaved.
+        if (workers or 1) > 1:
+            raise CopyOptionsError("Only one worker can write to stdout")
+        workers = 1
+    if max_records < ALL_RECORDS:
+        # Workers' slices are of different sizes, so they can't share a limit.
+        if (workers or 1) > 1:
+            raise CopyOptionsError("max_records can only be used with one worker")
+        workers = 1
+    if copy_kwargs.get("since"):
+        # Without a modification date field, the filter would fail or match
+        # nothing, and the copy would still count for the next --since last.
+        profile_module = load_profile(copy_kwargs.get("profile"))
+        searcher = get_searcher(copy_kwargs["source_type"], copy_kwargs["source_url"])
+        if not (
+            getattr(profile_module, "MODIFIED_FIELD", None) or searcher.modified_field
+        ):
+            raise CopyOptionsError(
+                f"{copy_kwargs['source_type']} records have no modification date "
+                "field to copy since; set MODIFIED_FIELD in the profile"
+            )
+    checkpoints = load_checkpoints(checkpoint_name)
+    index_name = None
+    if resume:
+        if not checkpoints:
+            raise CopyOptionsError(f"No interrupted copy into {destination_index_name}")
+        last_run = checkpoints[0]
+        last_workers = last_run["partition"][1] if last_run["partition"] else 1
+        # Continue with as many workers as before, unless told otherwise.
+        workers = workers or last_workers
+        if last_workers != workers:
+            raise CopyOptionsError(
+                f"Can't resume: the last copy had {last_workers} workers"
+            )
+        # Likewise for paging, since a checkpoint is a position in its pages.
+        last_paging = last_run.get("paging")
+        if last_paging:
+            paging = copy_kwargs.get("paging") or last_paging
+            if paging != last_paging:
+                raise CopyOptionsError(
+                    f"Can't resume: the last copy used {last_paging} paging"
+                )
+            copy_kwargs["paging"] = paging
+        started = datetime.fromisoformat(last_run["started"])
+        if versioned:
+            index_name = last_run["index"]
+            if index_name == destination_index_name:
+                raise CopyOptionsError(
+                    "Can't resume: the last copy was not --versioned"
+                )
+            if not es_client.indices.exists(index=index_name):
+                raise CopyOptionsError(f"Can't resume: {index_name} no longer exists")
+            print(f"Resuming copy into {index_name}")
+    elif not copy_kwargs.get("since"):
+        # Copying everything again, so earlier failures are retried anyway.
+        delete_dead_letters(checkpoint_name)
+    if not resume and checkpoints:
+        # Start over, removing what's left of the interrupted copy.
+        last_index = checkpoints[0]["index"]
+        if (
+            es_client
+            and last_index != destination_index_name
+            and es_client.indices.exists(index=last_index)
+        ):
+            es_client.indices.delete(index=last_index)
+            print(f"Deleted incomplete index {last_index}")
+        delete_checkpoints(checkpoint_name)
+
+    plan = plan_copy(
+        copy_kwargs["source_type"], workers=workers, paging=copy_kwargs.get("paging")
+    )
+    print(f"Copying with {plan['paging']} paging, workers: {plan['workers']}")
+    workers = plan["workers"]
+    copy_kwargs["paging"] = plan["paging"]
+
+    if apply_template:
+        with open(apply_template) as f:
+            put_index_template(es_client, destination_index_name, json.load(f))
+        print(f"Applied index template {apply_template}")
+        if not versioned and es_client.indices.exists(index=destination_index_name):
+            print(
+                f"{destination_index_name} already exists; the template only "
+                "applies when it is created, e.g. by a --versioned copy"
+            )
+
+    if versioned:
+        if not index_name:
+            index_name = create_versioned_index(es_client, destination_index_name)
+            print(f"Copying into new index {index_name}")
+        copy_kwargs["destination_index_name"] = index_name
+    elif copy_kwargs.get("skip_unchanged"):
+        # Saved hashes are tied to the index's uuid, so it has to exist
+        # before any worker opens the hash store.
+        if not es_client.indices.exists(index=destination_index_name):
+            es_client.indices.create(index=destination_index_name)
+
+    copy_kwargs["started"] = format_timestamp(started)
+    try:
+        if workers > 1:
+            result = copy_records_parallel(workers, **copy_kwargs)
+        else:
+            result = copy_records(**copy_kwargs)
+    except BaseException:
+        print(
+            f"Copy into {copy_kwargs['destination_index_name']} did not finish; "
+            "continue it with --resume."
+        )
+        raise
+
+    if versioned:
+        print(f"Optimizing {index_name}")
+        finish_versioned_index(es_client, destination_index_name, index_name)
+        expired = swap_alias(
+            es_client, destination_index_name, index_name, keep_versions
+        )
+        print(f"Pointed {destination_index_name} to {index_name}")
+        for name in expired:
+            print(f"Deleted old index {name}")
+    delete_checkpoints(checkpoint_name)
+
+    labels = {"index": destination_index_name}
+    if copy_kwargs.get("metrics_log"):
+        with open(copy_kwargs["metrics_log"], "a") as f:
+            metrics.log_json(f, "summary", result.metrics, **labels)
+    if metrics_textfile:
+        metrics.write_textfile(metrics_textfile, result.metrics, **labels)
+    if metrics_pushgateway:
+        metrics.push(metrics_pushgateway, result.metrics, **labels)
+
+    # Only a complete copy can be the starting point for the next copy --since last;
+    # otherwise records which failed would not be picked up again.
+    if to_elasticsearch and result.errors == 0 and max_records >= result.hits:
+        if copy_kwargs.get("source_type") == "file":
+            # Records are only as recent as the dump.
+            started = datetime.fromisoformat(
+                read_manifest(copy_kwargs["source_url"])["started"]
+            )
+        save_high_water_mark(destination_index_name, started)
+    return result
+
+
+def dump_records(
+    source_url: str,
+    source_type: str,
+    dump_dir: str,
+    profile: str | None = None,
+    max_records: int = ALL_RECORDS,
+    chunk_size: int = CHUNK_SIZE,
+    **search_kwargs,
+) -> dict:
+    """Save raw source records to a local dump directory, which can be copied
+    from later with source type file, without fetching from the source again.
+
+    All fields of the records matching the profile's SOURCE_QUERY are saved,
+    so the dump can be used with any changes to the profile's mapping.
+    Returns the dump's manifest.
+    """
+    profile_module = load_profile(profile)
+    source_query = getattr(profile_module, "SOURCE_QUERY", "*:*")
+    modified_field = getattr(profile_module, "MODIFIED_FIELD", None)
+
+    dump_path = Path(dump_dir)
+    dump_path.mkdir(parents=True, exist_ok=True)
+    if any(dump_path.iterdir()):
+        raise CopyOptionsError(f"{dump_dir} is not empty")
+
+    started = datetime.now(timezone.utc)
+    searcher = get_searcher(source_type, source_url)
+    results = searcher.search(
+        source_query,
+        max_records=max_records,
+        modified_field=modified_field,
+        **search_kwargs,
+    )
+
+    pipeline = Pipeline()
+    source_chunks = pipeline.new_queue()
+    chunks = []
+
+    def fetch() -> None:
+        """Fetch source records, in chunks."""
+        for batch in _batched(results, chunk_size):
+            pipeline.put(source_chunks, batch)
+        pipeline.put(source_chunks, pipeline.DONE)
+
+    def write() -> None:
+        """Compress and write chunks, while the next ones are fetched."""
+        for batch in pipeline.iterate(source_chunks):
+            chunks.append(write_chunk(dump_path, len(chunks), batch))
+            done = sum(chunk["records"] for chunk in chunks)
+            print(f"{done} / {min(searcher.hits, max_records)}")
+
+    pipeline.start(fetch)
+    pipeline.start(write)
+    pipeline.join()
+
+    write_manifest(
+        dump_path, source_url, source_type, source_query, started, searcher.hits, chunks
+    )
+    return read_manifest(dump_path)
+
+
+@dataclass
+class SyncResult:
+    """Counts from removing records which are no longer in the source."""
+
+    source_ids: int = 0
+    index_ids: int = 0
+    orphans: int = 0
+    deleted: int = 0
+
+
+def sync_deletes(
+    source_url: str,
+    source_type: str,
+    destination_index_name: str,
+    elastic_url: str,
+    elastic_api_key: str | None,
+    profile: str | None,
+    dry_run: bool = False,
+    **search_kwargs,
+) -> SyncResult:
+    """Delete documents from an Elasticsearch index whose records are no longer
+    in the source (or no longer match the profile's SOURCE_QUERY).
+
+    Only ids are fetched from both sides: the profile's ID_FIELDS from the source,
+    and no _source from Elasticsearch. Ids are collected in a temporary on-disk
+    SQLite database rather than in memory, so this works for any size of index.
+    """
+    profile_module = load_profile(profile)
+    get_id = getattr(profile_module, "get_id", lambda x: x["id"])
+    map_record = getattr(profile_module, "map_record", lambda x: x)
+    source_query = getattr(profile_module, "SOURCE_QUERY", "*:*")
+    id_fields = getattr(profile_module, "ID_FIELDS", ["id"])
+
+    searcher = get_searcher(source_type, source_url)
+    es_client = get_es_client(elastic_url, elastic_api_key)
+    result = SyncResult()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = sqlite3.connect(f"{tmp_dir}/ids.db")
+        db.execute("CREATE TABLE source_ids (id TEXT PRIMARY KEY) WITHOUT ROWID")
+        db.execute("CREATE TABLE index_ids (id TEXT PRIMARY KEY) WITHOUT ROWID")
+
+        # Elasticsearch ids are derived from mapped records, so map the
+        # (partial) source records in the same way as copy does.
+        results = searcher.search(source_query, fields=id_fields, **search_kwargs)
+        for batch in _batched(results, 10_000):
+            ids = [(get_id(map_record(doc)),) for doc in batch]
+            db.executemany("INSERT OR IGNORE INTO source_ids VALUES (?)", ids)
+            result.source_ids += len(ids)
+            print(f"Source ids: {result.source_ids} / {searcher.hits}")
+
+        # Deleting based on an incomplete list of source ids would delete
+        # far too much, so be sure the source has been read completely.
+        if result.source_ids == 0 or result.source_ids < searcher.hits:
+            raise RuntimeError(
+                f"Only got {result.source_ids} of {searcher.hits} source ids; "
+                "not deleting anything."
+            )
+
+        hits = scan(
+            es_client,
+            index=destination_index_name,
+            query={"query": {"match_all": {}}, "_source": False},
+            size=5000,
+        )
+        for batch in _batched(hits, 10_000):
+            ids = [(hit["_id"],) for hit in batch]
+            db.executemany("INSERT OR IGNORE INTO index_ids VALUES (?)", ids)
+            result.index_ids += len(ids)
+
+        orphans_query = "SELECT id FROM index_ids EXCEPT SELECT id FROM source_ids"
+        (result.orphans,) = db.execute(
+            f"SELECT COUNT(*) FROM ({orphans_query})"
+        ).fetchone()
+        print(f"{result.orphans} of {result.index_ids} indexed records not in source.")
+
+        orphans = (row[0] for row in db.execute(orphans_query))
+        if dry_run:
+            for orphan in orphans:
+                print(f"Would delete {orphan}")
+        else:
+            hash_store = None
+            if has_hash_store(destination_index_name):
+                hash_store = HashStore(
+                    destination_index_name,
+                    get_index_uuid(es_client, destination_index_name),
+                )
+            result.deleted = _delete_docs(
+                es_client, destination_index_name, orphans, hash_store
+            )
+        db.close()
+
+    return result
+
+
+def _delete_docs(
+    es_client: Elasticsearch,
+    index_name: str,
+    doc_ids: Iterable[str],
+    hash_store: HashStore | None = None,
+) -> int:
+    """Delete documents from an Elasticsearch index in bulk, and from its
+    hash store if given, returning the number deleted."""
+    deleted = 0
+    deleted_ids = []
+    actions = ({"_op_type": "delete", "_id": doc_id} for doc_id in doc_ids)
+    for ok, item in streaming_bulk(
+        client=es_client,
+        index=index_name,
+        actions=actions,
+        max_retries=5,
+        initial_backoff=2,
+        max_backoff=60,
+        request_timeout=30,
+        raise_on_error=False,
+        raise_on_exception=False,
+    ):
+        # Already deleted is fine too.
+        if ok or item.get("delete", {}).get("status") == 404:
+            deleted += 1
+            deleted_ids.append(item["delete"]["_id"])
+        else:
+            print(f"ERROR: {item}")
+    if hash_store:
+        hash_store.delete_many(deleted_ids)
+        hash_store.close()
+    return deleted
+
+
+def fetch_mapped(
+    profile_module: ModuleType | None,
+    source_url: str,
+    source_type: str,
+    ids: list[str],
+    **search_kwargs,
+) -> Generator[tuple[dict, dict], Any, Any]:
+    """Fetch the source records with the given ids, in batches, and map them
+    with the profile, yielding each document (with its _id) and the record's
+    id fields. ids are values of the first of the profile's ID_FIELDS, which
+    identifies records in the source."""
+    get_id = getattr(profile_module, "get_id", lambda x: x["id"])
+    map_record = getattr(profile_module, "map_record", lambda x: x)
+    source_query = getattr(profile_module, "SOURCE_QUERY", "*:*")
+    source_fields = getattr(profile_module, "SOURCE_FIELDS", None)
+    id_fields = getattr(profile_module, "ID_FIELDS", ["id"])
+    searcher = get_searcher(source_type, source_url)
+    docs = searcher.fetch_by_ids(
+        source_query,
+        id_fields[0],
+        ids,
+        fields=source_fields and list(dict.fromkeys(source_fields + id_fields)),
+        **search_kwargs,
+    )
+    for doc in docs:
+        es_doc = map_record(doc)
+        # Explicitly set _id, used by bulk_load for each record.
+        es_doc["_id"] = get_id(es_doc)
+        yield es_doc, {field: doc.get(field) for field in id_fields}
+
+
+def copy_ids(
+    destination_index_name: str,
+    elastic_url: str,
+    elastic_api_key: str | None,
+    profile: str | None,
+    source_url: str,
+    source_type: str,
+    ids: list[str],
+    **search_kwargs,
+) -> CopyResult:
+    """Copy only the source records with the given ids (see fetch_mapped) to
+    an Elasticsearch index, e.g. to correct a few records without a full copy.
+
+    Records are fetched in batches and mapped and loaded as by copy_records.
+    Documents which fail to load are saved for retry_failed; ids which aren't
+    in the source are listed.
+    """
+    ids = list(dict.fromkeys(ids))
+    profile_module = load_profile(profile)
+    id_field = getattr(profile_module, "ID_FIELDS", ["id"])[0]
+    result = CopyResult()
+    found = set()
+    # Documents being loaded, by _id, with their source id fields (for dead letters).
+    in_flight: dict[str, deque[tuple[dict, dict]]] = defaultdict(deque)
+
+    def _generate_docs() -> Generator[dict, Any, Any]:
+        """Generator for use by bulk_load."""
+        for es_doc, source_id in fetch_mapped(
+            profile_module, source_url, source_type, ids, **search_kwargs
+        ):
+            found.add(str(source_id.get(id_field)))
+            in_flight[es_doc["_id"]].append((source_id, es_doc))
+            yield es_doc
+
+    es_client = get_es_client(elastic_url, elastic_api_key)
+    dead_letters = DeadLetters(destination_index_name)
+    for ok, item in bulk_load(
+        es_client, destination_index_name, _generate_docs(), BulkSizer()
+    ):
+        doc_id = item["index"]["_id"]
+        source_id, es_doc = in_flight[doc_id].popleft()
+        if not in_flight[doc_id]:
+            del in_flight[doc_id]
+        if ok:
+            result.completed += 1
+        else:
+            result.errors += 1
+            print(f"ERROR: {item}")
+            dead_letters.add(
+                doc_id,
+                source_id,
+                item["index"].get("error"),
+                {key: value for key, value in es_doc.items() if key != "_id"},
+            )
+    dead_letters.flush()
+
+    result.hits = len(found)
+    missing = [source_id for source_id in ids if source_id not in found]
+    if missing:
+        print(f"{len(missing)} ids not found in the source: {', '.join(missing)}")
+    return result
+
+
+@dataclass
+class RetryResult:
+    """Counts from retrying documents which failed to load."""
+
+    failed: int = 0
+    missing: int = 0
+    completed: int = 0
+    errors: int = 0
+
+
+def retry_failed(
+    destination_index_name: str,
+    elastic_url: str,
+    elastic_api_key: str | None,
+    profile: str | None,
+    source_url: str | None = None,
+    source_type: str | None = None,
+    resend: bool = False,
+    **search_kwargs,
+) -> RetryResult:
+    """Load the documents which failed to load in earlier copies into
+    destination_index_name again.
+
+    By default, their records are fetched from the source again by id, in batches,
+    and mapped with the profile, e.g. after fixing a mapping problem. If resend,
+    the documents saved when they failed are sent again unchanged, e.g. after
+    fixing the index's mapping. Documents which fail again are kept for the next
+    retry; records which are no longer in the source are dropped.
+    """
+    dead_letters = load_dead_letters(destination_index_name)
+    result = RetryResult(failed=len(dead_letters))
+    if not dead_letters:
+        return result
+
+    if resend:
+        es_docs = [
+            {**dead_letter["doc"], "_id": doc_id}
+            for doc_id, dead_letter in dead_letters.items()
+        ]
+    else:
+        profile_module = load_profile(profile)
+        id_field = getattr(profile_module, "ID_FIELDS", ["id"])[0]
+        source_ids = list(
+            dict.fromkeys(
+                str(dead_letter["source_id"][id_field])
+                for dead_letter in dead_letters.values()
+                if dead_letter["source_id"].get(id_field) is not None
+            )
+        )
+        es_docs = [
+            es_doc
+            for es_doc, _ in fetch_mapped(
+                profile_module, source_url, source_type, source_ids, **search_kwargs
+            )
+        ]
+        result.missing = len(dead_letters.keys() - {d["_id"] for d in es_docs})
+
+    es_client = get_es_client(elastic_url, elastic_api_key)
+    still_failed = []
+    docs_by_id = {es_doc["_id"]: es_doc for es_doc in es_docs}
+    for ok, item in bulk_load(es_client, destination_index_name, es_docs, BulkSizer()):
+        if ok:
+            result.completed += 1
+        else:
+            result.errors += 1
+            print(f"ERROR: {item}")
+            still_failed.append(item["index"])
+
+    # Replace the dead letters with the documents which failed again.
+    delete_dead_letters(destination_index_name)
+    retried_dead_letters = DeadLetters(destination_index_name)
+    for item in still_failed:
+        doc_id = item["_id"]
+        es_doc = docs_by_id[doc_id]
+        source_id = dead_letters.get(doc_id, {}).get("source_id", {})
+        retried_dead_letters.add(
+            doc_id,
+            source_id,
+            item.get("error"),
+            {key: value for key, value in es_doc.items() if key != "_id"},
+        )
+    retried_dead_letters.flush()
+    return result
@@ -0,0 +1,119 @@
+from datetime import datetime, timezone
+
+from elasticsearch import Elasticsearch, NotFoundError, TransportError
+
+# Settings for fast bulk loading into a new index, which no one is searching yet:
+# no refreshes, no replicas to copy to, and fewer translog flushes.
+BULK_LOAD_SETTINGS = {
+    "index": {
+        "refresh_interval": "-1",
+        "number_of_replicas": 0,
+        "translog": {"flush_threshold_size": "1gb"},
+    }
+}
+
+
+def versioned_index_name(alias: str) -> str:
+    """Get a new, timestamped index name for an alias:
+    central-search-calursus-20240131080000 for central-search-calursus."""
+    return f"{alias}-{datetime.now(timezone.utc):%Y%m%d%H%M%S}"
+
+
+def put_index_template(es_client: Elasticsearch, index: str, template: dict) -> None:
+    """Create or replace the index template for index (see templates.py), so it
+    applies to index and its versions (index-*) when they are created."""
+    template = {**template, "index_patterns": [index, f"{index}-*"]}
+    es_client.indices.put_index_template(name=index, body=template)
+
+
+def create_versioned_index(es_client: Elasticsearch, alias: str) -> str:
+    """Create a new index for an alias, with settings tuned for bulk loading,
+    and return its name."""
+    if es_client.indices.exists(index=alias) and not es_client.indices.exists_alias(
+        name=alias
+    ):
+        raise ValueError(
+            f"{alias} is an index, not an alias; "
+            "delete or rename it before copying to versioned indexes."
+        )
+    index_name = versioned_index_name(alias)
+    es_client.indices.create(index=index_name, body={"settings": BULK_LOAD_SETTINGS})
+    return index_name
+
+
+def version_replicas(es_client: Elasticsearch, alias: str, index_name: str) -> int:
+    """Get the number of replicas a new version of alias should have once
+    loaded: as many as the version alias points to now, or otherwise as many as
+    index templates (or Elasticsearch's default, 1) give a new index."""
+    try:
+        current = es_client.indices.get_settings(
+            index=alias, name="index.number_of_replicas"
+        )
+    except NotFoundError:
+        current = {}
+    for name, settings in current.items():
+        if name != index_name:
+            return int(settings["settings"]["index"]["number_of_replicas"])
+    try:
+        simulated = es_client.indices.simulate_index_template(name=index_name)
+    except TransportError:
+        # Elasticsearch before 7.9 can't simulate templates.
+        return 1
+    index_settings = simulated["template"]["settings"].get("index", {})
+    return int(index_settings.get("number_of_replicas", 1))
+
+
+def finish_versioned_index(
+    es_client: Elasticsearch, alias: str, index_name: str
+) -> None:
+    """Restore normal settings on a bulk loaded index, with the replicas it
+    would otherwise have (see version_replicas), and merge its segments since
+    it won't be written to again."""
+    es_client.indices.put_settings(
+        index=index_name,
+        body={
+            "index": {
+                "refresh_interval": None,
+                "number_of_replicas": version_replicas(es_client, alias, index_name),
+                "translog": {"flush_threshold_size": None},
+            }
+        },
+    )
+    es_client.indices.refresh(index=index_name)
+    es_client.indices.forcemerge(
+        index=index_name, max_num_segments=1, request_timeout=3600
+    )
+
+
+def swap_alias(
+    es_client: Elasticsearch, alias: str, index_name: str, keep_versions: int = 2
+) -> list[str]:
+    """Point alias at index_name, removing it from any other indexes in the same
+    atomic update, so searches never see a missing or partial index.
+
+    keep_versions previous versions are kept for rollback; older ones are
+    deleted. Returns the names of deleted indexes.
+    """
+    try:
+        current_indexes = list(es_client.indices.get_alias(name=alias))
+    except NotFoundError:
+        current_indexes = []
+
+    actions = [
+        {"remove": {"index": current, "alias": alias}}
+        for current in current_indexes
+        if current != index_name
+    ]
+    actions.append({"add": {"index": index_name, "alias": alias}})
+    es_client.indices.update_aliases(body={"actions": actions})
+
+    # Version names sort by timestamp, newest last.
+    old_versions = sorted(
+        name
+        for name in es_client.indices.get(index=f"{alias}-*")
+        if name != index_name and name[len(alias) + 1 :].isdigit()
+    )
+    expired = old_versions[: max(len(old_versions) - keep_versions, 0)]
+    for name in expired:
+        es_client.indices.delete(index=name)
+    return expired
@@ -0,0 +1,347 @@
+"""Harvest several sources in one run, as described by a job manifest.
+
+A manifest is a TOML file like harvest.toml:
+
+    [harvest]
+    elastic_url = "${ELASTIC_URL}"
+    elastic_api_key = "${ELASTIC_API_KEY}"
+    max_sources = 4         # sources copied at the same time
+    max_bulk_requests = 8   # Elasticsearch bulk requests in flight, for all sources
+
+    [defaults]              # options for every source, unless it sets its own
+    retries = 1
+
+    [sources.dataverse]
+    source_url = "https://dataverse.ucla.edu/api/search"
+    source_type = "dataverse"
+    destination_index_name = "central-search-dataverse"
+    profile = "config.dataverse"
+
+Source options are those of copy, with underscores (workers, bulk_workers,
+versioned, since, sink and so on), plus retries and retry_delay (seconds);
+sources can't be written to stdout.
+${NAME} in any string is replaced by environment variable NAME, as in a shell,
+so credentials don't have to be in the manifest.
+"""
+
+import multiprocessing
+import os
+import re
+import sys
+import time
+import tomllib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+from dataclasses import dataclass
+from typing import Any, TextIO
+
+from bulk import limit_requests
+from drivers import PARALLEL_SLICES, source_types, supports
+from harvest import CopyOptionsError, copy_checkpoint_name, run_copy
+from sinks import FILE_SINKS, SINKS
+from state import load_checkpoints, load_duration, resolve_since, save_duration
+
+MAX_SOURCES = 4
+MAX_BULK_REQUESTS = 8
+RETRY_DELAY = 60
+
+# Options each source can have, with their types.
+SOURCE_OPTIONS = {
+    "source_url": str,
+    "source_type": str,
+    "destination_index_name": str,
+    "profile": str,
+    "max_records": int,
+    "def_type": str,
+    "paging": str,
+    "workers": int,
+    "bulk_workers": int,
+    "since": str,
+    "versioned": bool,
+    "keep_versions": int,
+    "skip_unchanged": bool,
+    "source_concurrency": int,
+    "stream": bool,
+    "sink": str,
+    "output": str,
+    "apply_template": str,
+    "metrics_log": str,
+    "metrics_textfile": str,
+    "metrics_pushgateway": str,
+    "retries": int,
+    "retry_delay": int | float,
+}
+REQUIRED_OPTIONS = ("source_url", "source_type", "destination_index_name")
+HARVEST_OPTIONS = {
+    "elastic_url": str,
+    "elastic_api_key": str,
+    "max_sources": int,
+    "max_bulk_requests": int,
+}
+
+
+@dataclass
+class SourceResult:
+    """Outcome of harvesting one source of a manifest."""
+
+    name: str
+    index: str
+    completed: int = 0
+    hits: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+    attempts: int = 0
+    # Why the last attempt failed, if it did.
+    error: str | None = None
+
+
+def expand_env(value: Any) -> Any:
+    """Replace ${NAME} and $NAME in strings with environment variables;
+    like a shell, unset variables are replaced with nothing."""
+    if not isinstance(value, str):
+        return value
+    return re.sub(
+        r"\$\{(\w+)\}|\$(\w+)",
+        lambda match: os.environ.get(match.group(1) or match.group(2), ""),
+        value,
+    )
+
+
+def _check_options(where: str, options: dict, allowed: dict) -> None:
+    for name, value in options.items():
+        if name not in allowed:
+            raise ValueError(f"{where}: unknown option {name}")
+        # bool is a subclass of int, but true isn't a number of workers.
+        wrong_bool = isinstance(value, bool) and allowed[name] is not bool
+        if wrong_bool or not isinstance(value, allowed[name]):
+            raise ValueError(f"{where}: {name} has the wrong type")
+
+
+def validate_source(name: str, source: dict) -> None:
+    """Check a source's options, as the copy command does."""
+    where = f"Source {name}"
+    _check_options(where, source, SOURCE_OPTIONS)
+    for option in REQUIRED_OPTIONS:
+        if not source.get(option):
+            raise ValueError(f"{where}: {option} is required")
+    if source["source_type"] not in source_types():
+        raise ValueError(f"{where}: unsupported source_type {source['source_type']}")
+    if source.get("versioned") and source.get("since"):
+        raise ValueError(f"{where}: since can't be used with versioned")
+    if source.get("versioned") and source.get("skip_unchanged"):
+        raise ValueError(f"{where}: skip_unchanged can't be used with versioned")
+    sink = source.get("sink", "elasticsearch")
+    if sink not in SINKS or sink == "stdout":
+        raise ValueError(f"{where}: unsupported sink {sink}")
+    if sink in FILE_SINKS and not source.get("output"):
+        raise ValueError(f"{where}: output is required for the {sink} sink")
+    if sink != "elasticsearch" and (
+        source.get("versioned")
+        or source.get("skip_unchanged")
+        or source.get("apply_template")
+    ):
+        raise ValueError(
+            f"{where}: versioned, skip_unchanged and apply_template need "
+            "the elasticsearch sink"
+        )
+    if source.get("workers", 1) > 1 and "max_records" in source:
+        raise ValueError(f"{where}: max_records can only be used with one worker")
+    if source.get("workers", 1) > 1 and not supports(
+        source["source_type"], PARALLEL_SLICES
+    ):
+        raise ValueError(f"{where}: {source['source_type']} can't have workers")
+
+
+def load_manifest(path: str) -> dict:
+    """Read and check a job manifest, returning its harvest options and
+    sources, each with the defaults applied and environment variables expanded."""
+    with open(path, "rb") as f:
+        manifest = tomllib.load(f)
+    unknown = set(manifest) - {"harvest", "defaults", "sources"}
+    if unknown:
+        raise ValueError(f"Unknown manifest sections: {sorted(unknown)}")
+
+    harvest = {
+        name: expand_env(value) for name, value in manifest.get("harvest", {}).items()
+    }
+    _check_options("[harvest]", harvest, HARVEST_OPTIONS)
+    if not harvest.get("elastic_url"):
+        raise ValueError("[harvest]: elastic_url is required")
+    # An empty API key (e.g. from an unset variable) means none.
+    harvest["elastic_api_key"] = harvest.get("elastic_api_key") or None
+
+    defaults = manifest.get("defaults", {})
+    sources = {}
+    for name, options in manifest.get("sources", {}).items():
+        source = {
+            option: expand_env(value)
+            for option, value in {**defaults, **options}.items()
+        }
+        validate_source(name, source)
+        sources[name] = source
+    if not sources:
+        raise ValueError("No sources in manifest")
+    indexes = [source["destination_index_name"] for source in sources.values()]
+    if len(set(indexes)) < len(indexes):
+        raise ValueError("Sources must have different destination_index_name")
+    return {"harvest": harvest, "sources": sources}
+
+
+def schedule(sources: dict[str, dict]) -> list[str]:
+    """Order sources so the longest are started first, based on how long
+    their last copy took; those never copied before come first. With several
+    sources at a time, this makes the whole harvest take about as long as the
+    longest source, rather than waiting for it to start near the end."""
+    durations = {
+        name: load_duration(source["destination_index_name"])
+        for name, source in sources.items()
+    }
+    return sorted(
+        sources,
+        key=lambda name: -(durations[name] if durations[name] is not None else 1e12),
+    )
+
+
+class _PrefixedOutput:
+    """Writes output line by line, each prefixed with the source's name, so
+    the progress of sources harvested at the same time can be told apart."""
+
+    def __init__(self, output: TextIO, prefix: str):
+        self.output = output
+        self.prefix = prefix
+        self._line = ""
+
+    def write(self, text: str) -> int:
+        self._line += text
+        *lines, self._line = self._line.split("\n")
+        for line in lines:
+            self.output.write(f"{self.prefix}{line}\n")
+        self.output.flush()
+        return len(text)
+
+    def flush(self) -> None:
+        self.output.flush()
+
+
+def harvest_source(
+    name: str,
+    source: dict,
+    elastic_url: str,
+    elastic_api_key: str | None,
+    resume: bool = False,
+) -> SourceResult:
+    """Copy one source of a manifest, retrying as its options say.
+
+    Retries continue from the failed attempt's checkpoint, so records already
+    loaded aren't copied again. Invalid options (CopyOptionsError) aren't
+    retried.
+    """
+    copy_kwargs = dict(source)
+    retries = copy_kwargs.pop("retries", 0)
+    retry_delay = copy_kwargs.pop("retry_delay", RETRY_DELAY)
+    copy_kwargs["concurrency"] = copy_kwargs.pop("source_concurrency", 4)
+    index = copy_kwargs["destination_index_name"]
+    checkpoint_name = copy_checkpoint_name(
+        index, copy_kwargs.get("sink", "elasticsearch")
+    )
+    result = SourceResult(name=name, index=index)
+    started = time.monotonic()
+
+    with redirect_stdout(_PrefixedOutput(sys.stdout, f"[{name}] ")):
+        for attempt in range(retries + 1):
+            result.attempts = attempt + 1
+            try:
+                if copy_kwargs.get("since"):
+                    try:
+                        copy_kwargs["since"] = resolve_since(
+                            copy_kwargs["since"], index
+                        )
+                    except ValueError as e:
+                        raise CopyOptionsError(str(e))
+                copy_result = run_copy(
+                    elastic_url=elastic_url,
+                    elastic_api_key=elastic_api_key,
+                    resume=(resume or attempt > 0)
+                    and bool(load_checkpoints(checkpoint_name)),
+                    **copy_kwargs,
+                )
+            except CopyOptionsError as e:
+                result.error = str(e)
+                break
+            except Exception as e:
+                result.error = repr(e)
+                if attempt < retries:
+                    print(f"Failed: {e!r}; retrying in {retry_delay} seconds")
+                    time.sleep(retry_delay)
+                continue
+            result.error = None
+            result.completed = copy_result.completed
+            result.hits = copy_result.hits
+            result.errors = copy_result.errors
+            break
+
+    result.seconds = time.monotonic() - started
+    if result.error is None:
+        save_duration(index, result.seconds)
+    return result
+
+
+def harvest_all(
+    manifest_path: str,
+    only: list[str] | None = None,
+    max_sources: int | None = None,
+    max_bulk_requests: int | None = None,
+    resume: bool = False,
+) -> list[SourceResult]:
+    """Harvest the sources in a manifest (or only some of them), up to
+    max_sources at a time, each in its own process, with at most
+    max_bulk_requests Elasticsearch bulk requests in flight for all of them.
+    Arguments override the manifest's [harvest] options.
+    """
+    manifest = load_manifest(manifest_path)
+    harvest = manifest["harvest"]
+    sources = manifest["sources"]
+    if only:
+        missing = set(only) - set(sources)
+        if missing:
+            raise ValueError(f"Not in manifest: {', '.join(sorted(missing))}")
+        sources = {name: sources[name] for name in only}
+    max_sources = max_sources or harvest.get("max_sources", MAX_SOURCES)
+    max_bulk_requests = max_bulk_requests or harvest.get(
+        "max_bulk_requests", MAX_BULK_REQUESTS
+    )
+
+    # Shared with every source's process, and their workers' processes.
+    request_slots = multiprocessing.BoundedSemaphore(max_bulk_requests)
+    results = []
+    with ProcessPoolExecutor(
+        max_workers=min(max_sources, len(sources)),
+        initializer=limit_requests,
+        initargs=(request_slots,),
+    ) as executor:
+        futures = {
+            executor.submit(
+                harvest_source,
+                name,
+                sources[name],
+                harvest["elastic_url"],
+                harvest["elastic_api_key"],
+                resume,
+            ): name
+            for name in schedule(sources)
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # e.g. the source's process was killed.
+                result = SourceResult(
+                    name=name,
+                    index=sources[name]["destination_index_name"],
+                    error=repr(e),
+                )
+            status = "failed" if result.error else "done"
+            print(f"[{name}] {status} in {result.seconds:.0f} seconds")
+            results.append(result)
+    return sorted(results, key=lambda result: list(sources).index(result.name))
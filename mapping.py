@@ -0,0 +1,229 @@
+"""Declarative mapping profiles, compiled into fast record mappers.
+
+A profile is a dict describing how to map a source record to an Elasticsearch
+document. Steps are applied in this order; all are optional.
+
+keep: {source field: output field} - copy only these fields, renaming them.
+keep_all: True to copy all source fields instead, except those in
+    drop: [source field, ...].
+duplicate: {source field: output field} - with keep_all, also copy these fields
+    under another name.
+skip_values: [value, ...] - treat fields with any of these values as missing
+    (e.g. [" "]).
+wrap_lists: [output field, ...] - make these single values into lists.
+append: {output field: [source field, ...]} - add the values of these source fields
+    to an (existing) output list.
+dedupe: [output field, ...] - sort these lists and remove duplicates.
+concat: {output field: [output field, ...]} - combine the values of several
+    output fields into one list, e.g. "names"; only added if there are any values,
+    unless the output field is in
+    keep_empty: [output field, ...].
+templates: {output field: template} - values made from the source record with
+    str.format, e.g. "https://digital.library.ucla.edu/catalog/{ark_ssi}".
+computed: {output field: (function, [source field, ...])} - values computed
+    by calling function with the source record, which uses the given fields.
+constants: {output field: value} - the same value for every record.
+"""
+
+from string import Formatter
+from typing import Any, Callable, Iterable
+
+PROFILE_KEYS = frozenset(
+    {
+        "keep",
+        "keep_all",
+        "drop",
+        "duplicate",
+        "skip_values",
+        "wrap_lists",
+        "append",
+        "dedupe",
+        "concat",
+        "keep_empty",
+        "templates",
+        "computed",
+        "constants",
+    }
+)
+
+
+def _template_fields(template: str) -> set[str]:
+    """Get the source fields used by a str.format template:
+    {"collectionKey", "id"} for "{collectionKey[0]}/{id}"."""
+    fields = set()
+    for _, field_name, _, _ in Formatter().parse(template):
+        if field_name:
+            fields.add(field_name.split("[")[0].split(".")[0])
+    return fields
+
+
+class Mapper:
+    """Maps source records to Elasticsearch documents as described by a profile.
+
+    All the work which doesn't depend on the record (field lists, lookups and
+    which steps are needed at all) is done once, when the mapper is created.
+    """
+
+    def __init__(self, profile: dict):
+        unknown_keys = set(profile) - PROFILE_KEYS
+        if unknown_keys:
+            raise ValueError(f"Unknown profile keys: {sorted(unknown_keys)}")
+        if "keep" in profile and profile.get("keep_all"):
+            raise ValueError("Profile can't have both keep and keep_all")
+
+        self.profile = profile
+        self._keep = tuple(profile.get("keep", {}).items())
+        self._keep_all = bool(profile.get("keep_all"))
+        self._drop = frozenset(profile.get("drop", ()))
+        self._duplicate = tuple(profile.get("duplicate", {}).items())
+        self._skip_values = tuple(profile.get("skip_values", ()))
+        self._wrap_lists = tuple(profile.get("wrap_lists", ()))
+        self._append = tuple(
+            (target, tuple(sources))
+            for target, sources in profile.get("append", {}).items()
+        )
+        self._dedupe = tuple(profile.get("dedupe", ()))
+        self._concat = tuple(
+            (target, tuple(fields), target in profile.get("keep_empty", ()))
+            for target, fields in profile.get("concat", {}).items()
+        )
+        self._templates = tuple(profile.get("templates", {}).items())
+        self._computed = tuple(
+            (target, function)
+            for target, (function, _) in profile.get("computed", {}).items()
+        )
+        self._computed_fields = tuple(
+            field
+            for _, fields in profile.get("computed", {}).values()
+            for field in fields
+        )
+        self._constants = dict(profile.get("constants", {}))
+
+        # Only run the steps this profile uses.
+        self._project = self._project_all if self._keep_all else self._project_keep
+        steps = [
+            (self._wrap_lists, self._wrap_step),
+            (self._append, self._append_step),
+            (self._dedupe, self._dedupe_step),
+            (self._concat, self._concat_step),
+            (self._templates, self._templates_step),
+            (self._computed, self._computed_step),
+            (self._constants, self._constants_step),
+        ]
+        self._steps: tuple[Callable[[dict, dict], None], ...] = tuple(
+            step for config, step in steps if config
+        )
+
+    @property
+    def source_fields(self) -> list[str] | None:
+        """Source fields read by this mapper; None if it copies all fields."""
+        if self._keep_all:
+            return None
+        fields = [source for source, _ in self._keep]
+        for _, sources in self._append:
+            fields.extend(sources)
+        for _, template in self._templates:
+            fields.extend(sorted(_template_fields(template)))
+        fields.extend(self._computed_fields)
+        # Remove duplicates, keeping order.
+        return list(dict.fromkeys(fields))
+
+    def output_fields(self, source_fields: Iterable[str] = ()) -> list[str]:
+        """Fields documents mapped by this mapper can have, given the fields of
+        source records (only needed if it copies all fields)."""
+        if self._keep_all:
+            fields = [field for field in source_fields if field not in self._drop]
+            fields.extend(target for _, target in self._duplicate)
+        else:
+            fields = [target for _, target in self._keep]
+        fields.extend(target for target, _ in self._append)
+        fields.extend(target for target, _, _ in self._concat)
+        fields.extend(target for target, _ in self._templates)
+        fields.extend(target for target, _ in self._computed)
+        fields.extend(self._constants)
+        # Remove duplicates, keeping order.
+        return list(dict.fromkeys(fields))
+
+    def __call__(self, record: dict) -> dict:
+        output_record = self._project(record)
+        for step in self._steps:
+            step(record, output_record)
+        return output_record
+
+    def _project_keep(self, record: dict) -> dict:
+        skip_values = self._skip_values
+        output_record = {}
+        for source, target in self._keep:
+            if source in record:
+                value = record[source]
+                if skip_values and value in skip_values:
+                    continue
+                output_record[target] = value
+        return output_record
+
+    def _project_all(self, record: dict) -> dict:
+        drop = self._drop
+        skip_values = self._skip_values
+        if skip_values:
+            output_record = {
+                key: value
+                for key, value in record.items()
+                if key not in drop and value not in skip_values
+            }
+        else:
+            output_record = {
+                key: value for key, value in record.items() if key not in drop
+            }
+        # Duplicates are added after the fields copied from the record.
+        for source, target in self._duplicate:
+            if source in output_record:
+                output_record[target] = output_record[source]
+        return output_record
+
+    def _wrap_step(self, record: dict, output_record: dict) -> None:
+        for field in self._wrap_lists:
+            if field in output_record:
+                output_record[field] = [output_record[field]]
+
+    def _append_step(self, record: dict, output_record: dict) -> None:
+        for target, sources in self._append:
+            if target in output_record:
+                # Make a new list, rather than changing one from the source record.
+                output_record[target] = output_record[target] + [
+                    record[source] for source in sources if source in record
+                ]
+
+    def _dedupe_step(self, record: dict, output_record: dict) -> None:
+        for field in self._dedupe:
+            if isinstance(output_record.get(field), list):
+                output_record[field] = sorted(set(output_record[field]))
+
+    def _concat_step(self, record: dict, output_record: dict) -> None:
+        for target, fields, keep_empty in self._concat:
+            values = []
+            for field in fields:
+                value = output_record.get(field)
+                if not value:
+                    continue
+                if isinstance(value, list):
+                    values.extend(value)
+                else:
+                    values.append(value)
+            if values or keep_empty:
+                output_record[target] = values
+
+    def _templates_step(self, record: dict, output_record: dict) -> None:
+        for target, template in self._templates:
+            output_record[target] = template.format_map(record)
+
+    def _computed_step(self, record: dict, output_record: dict) -> None:
+        for target, function in self._computed:
+            output_record[target] = function(record)
+
+    def _constants_step(self, record: dict, output_record: dict) -> None:
+        output_record.update(self._constants)
+
+
+def compile_profile(profile: dict[str, Any]) -> Mapper:
+    """Compile a mapping profile into a mapper, used as a profile's map_record."""
+    return Mapper(profile)
@@ -0,0 +1,281 @@
+"""Counters and latency histograms for the stages of a harvest.
+
+Stages are timed with the module-level registry, e.g.
+
+    with metrics.timer("map"):
+        es_docs = [map_record(doc) for doc in batch]
+    metrics.count("mapped_docs", len(es_docs))
+
+Stage names used: fetch (a page from the source, including decoding it),
+decode (JSON decoding only; streamed pages are decoded while fetching), map,
+bulk (an Elasticsearch bulk request).
+Each process (i.e. each --workers worker) has its own registry; snapshots
+of them can be combined with merge_snapshots.
+"""
+
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Generator, TextIO
+from urllib.parse import quote
+
+import requests
+
+import decoders
+
+# Upper bounds of histogram buckets, in seconds, as in Prometheus client defaults
+# with a few more for slow bulk requests.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Metrics:
+    """Thread-safe counters, and histograms of stage latencies."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.started = time.time()
+            self._counters: dict[str, float] = {}
+            # Per stage: [count in each bucket (the last one for > BUCKETS[-1]), sum, max]
+            self._histograms: dict[str, list] = {}
+
+    def count(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = [
+                    [0] * (len(BUCKETS) + 1),
+                    0.0,
+                    0.0,
+                ]
+            histogram[0][bisect_left(BUCKETS, seconds)] += 1
+            histogram[1] += seconds
+            histogram[2] = max(histogram[2], seconds)
+
+    @contextmanager
+    def timer(self, stage: str) -> Generator[None, Any, Any]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def snapshot(self) -> dict:
+        """Get the current values, as a dict which can be saved as JSON
+        or sent between processes."""
+        with self._lock:
+            return {
+                "started": self.started,
+                "elapsed": time.time() - self.started,
+                "counters": dict(self._counters),
+                "histograms": {
+                    stage: {"buckets": list(buckets), "sum": total, "max": maximum}
+                    for stage, (buckets, total, maximum) in self._histograms.items()
+                },
+            }
+
+
+REGISTRY = Metrics()
+count = REGISTRY.count
+observe = REGISTRY.observe
+timer = REGISTRY.timer
+
+
+class TimedJSONDecoder:
+    """JSON decoder which records its time and the bytes decoded, e.g. for pysolr.
+    Uses the fastest decoder installed; see decoders.py."""
+
+    def decode(self, s: str) -> Any:
+        count("source_bytes", len(s))
+        with timer("decode"):
+            return decoders.loads(s)
+
+
+def merge_snapshots(first: dict | None, second: dict | None) -> dict | None:
+    """Combine snapshots of registries in separate processes."""
+    if not first or not second:
+        return first or second
+    counters = dict(first["counters"])
+    for name, value in second["counters"].items():
+        counters[name] = counters.get(name, 0) + value
+    histograms = {stage: dict(h) for stage, h in first["histograms"].items()}
+    for stage, histogram in second["histograms"].items():
+        if stage not in histograms:
+            histograms[stage] = dict(histogram)
+            continue
+        merged = histograms[stage]
+        merged["buckets"] = [
+            a + b for a, b in zip(merged["buckets"], histogram["buckets"])
+        ]
+        merged["sum"] += histogram["sum"]
+        merged["max"] = max(merged["max"], histogram["max"])
+    started = min(first["started"], second["started"])
+    return {
+        "started": started,
+        # Processes run at the same time, so take the longest, not the total.
+        "elapsed": max(first["elapsed"], second["elapsed"]),
+        "counters": counters,
+        "histograms": histograms,
+    }
+
+
+def _quantile(buckets: list[int], q: float) -> float | None:
+    """Estimate a quantile as the upper bound of the bucket it falls in."""
+    total = sum(buckets)
+    if not total:
+        return None
+    seen = 0
+    for bound, bucket in zip(BUCKETS, buckets):
+        seen += bucket
+        if seen >= q * total:
+            return bound
+    return float("inf")
+
+
+def summarize(snapshot: dict) -> dict:
+    """Summarize a snapshot for logging: counters with their rates per second,
+    and count, mean, p50, p95 and max latency of each stage."""
+    elapsed = max(snapshot["elapsed"], 1e-9)
+    summary = {
+        "elapsed": round(snapshot["elapsed"], 3),
+        "counters": snapshot["counters"],
+        "rates": {
+            f"{name}_per_sec": round(value / elapsed, 1)
+            for name, value in snapshot["counters"].items()
+            if name.endswith(("_docs", "_bytes"))
+        },
+        "stages": {},
+    }
+    for stage, histogram in snapshot["histograms"].items():
+        stage_count = sum(histogram["buckets"])
+        summary["stages"][stage] = {
+            "count": stage_count,
+            "total": round(histogram["sum"], 3),
+            "mean": round(histogram["sum"] / stage_count, 4) if stage_count else None,
+            # Bucket bounds can be above the slowest time actually seen.
+            "p50": round(
+                min(_quantile(histogram["buckets"], 0.5), histogram["max"]), 4
+            ),
+            "p95": round(
+                min(_quantile(histogram["buckets"], 0.95), histogram["max"]), 4
+            ),
+            "max": round(histogram["max"], 4),
+        }
+    return summary
+
+
+def log_json(output: TextIO, event: str, snapshot: dict, **labels) -> None:
+    """Write a snapshot's summary as one JSON line."""
+    line = {
+        "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "event": event,
+        **labels,
+        **summarize(snapshot),
+    }
+    output.write(json.dumps(line) + "\n")
+    output.flush()
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_string(labels: dict) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+
+
+def prometheus_text(snapshot: dict, **labels) -> str:
+    """Format a snapshot in the Prometheus text exposition format."""
+    lines = []
+    base = _label_string(labels)
+    for name, value in sorted(snapshot["counters"].items()):
+        metric = f"centralsearch_{name}_total"
+        lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric}{{{base}}} {value}")
+
+    metric = "centralsearch_stage_seconds"
+    lines.append(f"# TYPE {metric} histogram")
+    for stage, histogram in sorted(snapshot["histograms"].items()):
+        stage_labels = _label_string({**labels, "stage": stage})
+        cumulative = 0
+        for bound, bucket in zip(BUCKETS, histogram["buckets"]):
+            cumulative += bucket
+            lines.append(f'{metric}_bucket{{{stage_labels},le="{bound}"}} {cumulative}')
+        cumulative += histogram["buckets"][-1]
+        lines.append(f'{metric}_bucket{{{stage_labels},le="+Inf"}} {cumulative}')
+        lines.append(f"{metric}_sum{{{stage_labels}}} {histogram['sum']}")
+        lines.append(f"{metric}_count{{{stage_labels}}} {cumulative}")
+
+    lines.append("# TYPE centralsearch_duration_seconds gauge")
+    lines.append(f"centralsearch_duration_seconds{{{base}}} {snapshot['elapsed']}")
+    lines.append("# TYPE centralsearch_last_run_timestamp_seconds gauge")
+    lines.append(
+        f"centralsearch_last_run_timestamp_seconds{{{base}}} "
+        f"{snapshot['started'] + snapshot['elapsed']}"
+    )
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path: str, snapshot: dict, **labels) -> None:
+    """Write a snapshot for node_exporter's textfile collector, atomically
+    so it never reads a partial file."""
+    tmp_path = Path(f"{path}.tmp")
+    tmp_path.write_text(prometheus_text(snapshot, **labels))
+    os.replace(tmp_path, path)
+
+
+def push(
+    gateway_url: str, snapshot: dict, job: str = "centralsearch", **labels
+) -> None:
+    """Send a snapshot to a Prometheus pushgateway, replacing the metrics of
+    earlier runs with the same labels."""
+    grouping = "".join(
+        f"/{name}/{quote(str(value), safe='')}" for name, value in labels.items()
+    )
+    response = requests.put(
+        f"{gateway_url.rstrip('/')}/metrics/job/{job}{grouping}",
+        data=prometheus_text(snapshot).encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4"},
+        timeout=30,
+    )
+    response.raise_for_status()
+
+
+@contextmanager
+def report_periodically(
+    path: str | None, interval: float = 10, **labels
+) -> Generator[None, Any, Any]:
+    """While in the context, append a JSON line with the registry's summary
+    to the file at path every interval seconds, and once more at the end.
+    Does nothing if path is None."""
+    if not path:
+        yield
+        return
+    stop = threading.Event()
+
+    def report() -> None:
+        while not stop.wait(interval):
+            with open(path, "a") as f:
+                log_json(f, "progress", REGISTRY.snapshot(), **labels)
+
+    thread = threading.Thread(target=report, name="metrics", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+        with open(path, "a") as f:
+            log_json(f, "progress", REGISTRY.snapshot(), **labels)
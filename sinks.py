@@ -0,0 +1,180 @@
+"""Outputs of copy: Elasticsearch, or files of documents to load later.
+
+elasticsearch: bulk loads into the index (see bulk.py).
+ndjson: writes each document, with its _id, as a line of JSON to a file;
+    gzipped if its name ends with .gz.
+bulk-file: writes Elasticsearch _bulk request bodies to files of up to
+    BULK_FILE_BYTES in a directory, which can be loaded later, e.g. with
+    curl -H "Content-Type: application/x-ndjson" --data-binary @FILE URL/_bulk
+stdout: writes documents as NDJSON to standard output.
+null: discards documents, e.g. to measure fetching and mapping alone.
+
+Every sink's write yields (ok, item) for each document, as bulk_load does, so
+copy counts, checkpoints and saves failures the same way whatever the output.
+Documents are serialized with decoders.dumps.
+"""
+
+import gzip
+import sys
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, BinaryIO, Generator, Iterable
+
+from elasticsearch import Elasticsearch
+
+import decoders
+import metrics
+from bulk import BulkSizer, bulk_load, index_action
+from dumps import COMPRESS_LEVEL
+from state import partition_suffix
+
+SINKS = ("elasticsearch", "ndjson", "bulk-file", "stdout", "null")
+# Sinks which write to an --output file or directory.
+FILE_SINKS = ("ndjson", "bulk-file")
+# Elasticsearch suggests bulk requests of a few MB.
+BULK_FILE_BYTES = 10 * 1024 * 1024
+
+
+class Sink(ABC):
+    """Writes documents (with their _id) for an index. Can be shared by threads."""
+
+    def __init__(self, index: str):
+        self.index = index
+
+    @abstractmethod
+    def write(self, docs: Iterable[dict]) -> Generator[tuple[bool, dict], Any, Any]:
+        """Write documents, yielding (ok, item) for each, as bulk_load does."""
+
+    def close(self) -> None:
+        pass
+
+    def _written(self, doc: dict) -> tuple[bool, dict]:
+        return True, {"index": {"_index": self.index, "_id": doc["_id"], "status": 201}}
+
+
+class ElasticsearchSink(Sink):
+    def __init__(self, index: str, es_client: Elasticsearch):
+        super().__init__(index)
+        self.es_client = es_client
+        # All writers share one sizer, so they back off together.
+        self.sizer = BulkSizer()
+
+    def write(self, docs: Iterable[dict]) -> Generator[tuple[bool, dict], Any, Any]:
+        return bulk_load(self.es_client, self.index, docs, self.sizer)
+
+
+class NullSink(Sink):
+    def write(self, docs: Iterable[dict]) -> Generator[tuple[bool, dict], Any, Any]:
+        for doc in docs:
+            yield self._written(doc)
+
+
+class NdjsonSink(Sink):
+    def __init__(self, index: str, file: BinaryIO, close_file: bool = True):
+        super().__init__(index)
+        self._file = file
+        self._close_file = close_file
+        self._lock = threading.Lock()
+
+    def write(self, docs: Iterable[dict]) -> Generator[tuple[bool, dict], Any, Any]:
+        for doc in docs:
+            line = decoders.dumps(doc) + b"\n"
+            with self._lock:
+                self._file.write(line)
+            metrics.count("output_bytes", len(line))
+            yield self._written(doc)
+
+    def close(self) -> None:
+        if self._close_file:
+            self._file.close()
+        else:
+            self._file.flush()
+
+
+class BulkFileSink(Sink):
+    """Writes _bulk request bodies to numbered files in a directory, each
+    starting when the last one reaches BULK_FILE_BYTES."""
+
+    def __init__(self, index: str, directory: Path, prefix: str, append: bool):
+        super().__init__(index)
+        self.directory = directory
+        self.prefix = prefix
+        existing = sorted(directory.glob(f"{prefix}-*.ndjson"))
+        if not append:
+            for path in existing:
+                path.unlink()
+            existing = []
+        self._number = len(existing)
+        self._file = None
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _next_file(self) -> None:
+        if self._file:
+            self._file.close()
+        path = self.directory / f"{self.prefix}-{self._number:05d}.ndjson"
+        self._file = open(path, "wb")
+        self._number += 1
+        self._size = 0
+
+    def write(self, docs: Iterable[dict]) -> Generator[tuple[bool, dict], Any, Any]:
+        for doc in docs:
+            action = index_action(self.index, doc)
+            with self._lock:
+                if not self._file or self._size + len(action) > BULK_FILE_BYTES:
+                    self._next_file()
+                self._file.write(action)
+                self._size += len(action)
+            metrics.count("output_bytes", len(action))
+            yield self._written(doc)
+
+    def close(self) -> None:
+        if self._file:
+            self._file.close()
+
+
+def _partition_path(path: Path, partition: tuple[int, int] | None) -> Path:
+    """Get the file for one worker's partition of a copy: out-0of4.ndjson.gz
+    for out.ndjson.gz."""
+    stem, dot, extensions = path.name.partition(".")
+    return path.with_name(f"{stem}{partition_suffix(partition)}{dot}{extensions}")
+
+
+def open_sink(
+    sink: str,
+    index: str,
+    output: str | None = None,
+    partition: tuple[int, int] | None = None,
+    es_client: Elasticsearch | None = None,
+    append: bool = False,
+) -> Sink:
+    """Open a sink for documents copied into index; output is the file or
+    directory of file sinks, and es_client the client for elasticsearch.
+
+    Each worker of a copy (partition) writes its own files. If append (when
+    resuming a copy), files are added to; otherwise they are replaced.
+    """
+    if sink == "elasticsearch":
+        return ElasticsearchSink(index, es_client)
+    if sink == "null":
+        return NullSink(index)
+    if sink == "stdout":
+        # The real standard output, even if progress messages are redirected.
+        return NdjsonSink(index, sys.__stdout__.buffer, close_file=False)
+    if sink not in FILE_SINKS:
+        raise ValueError(f"Unknown sink {sink}")
+    if not output:
+        raise ValueError(f"The {sink} sink needs an output path")
+    if sink == "bulk-file":
+        directory = Path(output)
+        directory.mkdir(parents=True, exist_ok=True)
+        return BulkFileSink(
+            index, directory, f"bulk{partition_suffix(partition)}", append
+        )
+    path = _partition_path(Path(output), partition)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    mode = "ab" if append else "wb"
+    if path.suffix == ".gz":
+        return NdjsonSink(index, gzip.open(path, mode, compresslevel=COMPRESS_LEVEL))
+    return NdjsonSink(index, open(path, mode))
@@ -0,0 +1,360 @@
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterable
+
+# Local directory for state kept between harvest runs, one file per
+# destination index. Can be overridden via environment variable.
+STATE_DIR = Path(os.environ.get("CENTRALSEARCH_STATE_DIR", ".harvest_state"))
+
+
+def state_file(index_name: str, suffix: str = ".json") -> Path:
+    """Get the path of a state file for an Elasticsearch index."""
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    return STATE_DIR / f"{index_name}{suffix}"
+
+
+def load_state(index_name: str, suffix: str = ".json") -> dict:
+    """Load the saved state for an index; empty if there is none."""
+    path = state_file(index_name, suffix)
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(index_name: str, state: dict, suffix: str = ".json") -> None:
+    """Save the state for an index, replacing the file atomically
+    so an interrupted write can't leave it corrupt."""
+    path = state_file(index_name, suffix)
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def format_timestamp(value: datetime) -> str:
+    """Format a datetime as a Solr-style UTC timestamp: 2024-01-31T08:00:00Z."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def resolve_since(since: str, index_name: str) -> str:
+    """Convert the copy --since value into a UTC timestamp.
+
+    since is either an ISO 8601 date / datetime (assumed to be UTC if no time zone
+    is given), or "last" for the start time of the last complete copy into index_name.
+    """
+    if since == "last":
+        high_water_mark = load_state(index_name).get("high_water_mark")
+        if not high_water_mark:
+            raise ValueError(f"No previous complete copy recorded for {index_name}")
+        return high_water_mark
+    return format_timestamp(datetime.fromisoformat(since))
+
+
+def save_high_water_mark(index_name: str, started: datetime) -> None:
+    """Record the start time of a complete copy into index_name; records modified
+    after this are picked up by the next copy --since last."""
+    state = load_state(index_name)
+    state["high_water_mark"] = format_timestamp(started)
+    save_state(index_name, state)
+
+
+def save_duration(index_name: str, seconds: float) -> None:
+    """Record how long the last complete copy into index_name took,
+    so harvest_all can start the slowest sources first."""
+    state = load_state(index_name)
+    state["last_duration"] = round(seconds, 1)
+    save_state(index_name, state)
+
+
+def load_duration(index_name: str) -> float | None:
+    return load_state(index_name).get("last_duration")
+
+
+def content_hash(doc: dict) -> bytes:
+    """Get a stable hash of a document's content, ignoring its _id
+    and the order of its fields."""
+    content = {key: value for key, value in doc.items() if key != "_id"}
+    serialized = json.dumps(
+        content, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str
+    )
+    return hashlib.blake2b(serialized.encode(), digest_size=16).digest()
+
+
+class HashStore:
+    """Content hashes of the documents loaded into an Elasticsearch index,
+    by document id, kept in a local SQLite database.
+
+    The store belongs to one instance of the index, identified by its uuid:
+    if the index has been deleted and recreated since the hashes were saved,
+    they are discarded, since the documents they describe are gone.
+
+    Can be shared by threads; separate processes can each open the same store.
+    """
+
+    # SQLite limits the number of variables in a query.
+    MAX_VARIABLES = 500
+
+    def __init__(self, index_name: str, index_uuid: str | None):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            state_file(index_name, ".hashes.db"), timeout=60, check_same_thread=False
+        )
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS hashes "
+                "(id TEXT PRIMARY KEY, hash BLOB) WITHOUT ROWID"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            row = self._db.execute(
+                "SELECT value FROM meta WHERE key = 'index_uuid'"
+            ).fetchone()
+            if row is None or row[0] != index_uuid:
+                self._db.execute("DELETE FROM hashes")
+                self._db.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('index_uuid', ?)",
+                    (index_uuid,),
+                )
+
+    def get_many(self, ids: list[str]) -> dict[str, bytes]:
+        """Get the saved hashes for ids, where there are any."""
+        hashes = {}
+        with self._lock:
+            for start in range(0, len(ids), self.MAX_VARIABLES):
+                chunk = ids[start : start + self.MAX_VARIABLES]
+                placeholders = ",".join("?" * len(chunk))
+                hashes.update(
+                    self._db.execute(
+                        f"SELECT id, hash FROM hashes WHERE id IN ({placeholders})",
+                        chunk,
+                    )
+                )
+        return hashes
+
+    def set_many(self, items: Iterable[tuple[str, bytes]]) -> None:
+        """Save (id, hash) pairs."""
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO hashes VALUES (?, ?)", items)
+
+    def delete_many(self, ids: Iterable[str]) -> None:
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM hashes WHERE id = ?", ((i,) for i in ids))
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def has_hash_store(index_name: str) -> bool:
+    return state_file(index_name, ".hashes.db").exists()
+
+
+def partition_suffix(partition: tuple[int, int] | None = None) -> str:
+    """Get the part of a state file name for one worker's partition of a copy."""
+    return f"-{partition[0]}of{partition[1]}" if partition else ""
+
+
+def checkpoint_suffix(partition: tuple[int, int] | None = None) -> str:
+    return f".checkpoint{partition_suffix(partition)}.json"
+
+
+def load_checkpoints(index_name: str) -> list[dict]:
+    """Load all saved checkpoints of a copy into index_name, one per worker."""
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    checkpoints = []
+    for path in sorted(STATE_DIR.glob(f"{index_name}.checkpoint*.json")):
+        with open(path) as f:
+            checkpoints.append(json.load(f))
+    return checkpoints
+
+
+def delete_checkpoints(index_name: str) -> None:
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    for path in STATE_DIR.glob(f"{index_name}.checkpoint*.json"):
+        path.unlink()
+
+
+@dataclass
+class _Page:
+    """A page of records registered with a Checkpoint."""
+
+    position: dict
+    remaining: int
+    completed: int = 0
+    unchanged: int = 0
+    failed_ids: list[str] = field(default_factory=list)
+
+
+class Checkpoint:
+    """Progress of a copy into an index (or of one worker's partition of it),
+    saved periodically so an interrupted copy can be resumed.
+
+    Each page of source records is registered with its position in the source
+    (see BaseSearch.search_pages), and each record is acknowledged once
+    Elasticsearch has loaded it, or it has failed or been skipped. The saved
+    position is after the last page which, along with all earlier pages, is
+    fully acknowledged, so resuming from it never misses a record; the saved
+    counts and failed ids are for the records up to that position.
+
+    run has details of the copy, which a resumed copy must match.
+    Can be shared by threads.
+    """
+
+    # Minimum number of seconds between saves.
+    SAVE_INTERVAL = 10
+
+    def __init__(
+        self,
+        index_name: str,
+        partition: tuple[int, int] | None,
+        run: dict,
+        resume_from: dict | None = None,
+    ):
+        self.index_name = index_name
+        self.suffix = checkpoint_suffix(partition)
+        self.run = run
+        resume_from = resume_from or {}
+        self.position: dict | None = resume_from.get("position")
+        self.completed: int = resume_from.get("completed", 0)
+        self.errors: int = resume_from.get("errors", 0)
+        self.unchanged: int = resume_from.get("unchanged", 0)
+        self.failed_ids: list[str] = resume_from.get("failed_ids", [])
+        # Pages not yet fully acknowledged, oldest first, by page number.
+        self._pages: dict[int, _Page] = {}
+        self._page_count = 0
+        self._saved = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add_page(self, position: dict, records: int) -> int:
+        """Register a page of records, returning its page number."""
+        with self._lock:
+            page = self._page_count
+            self._page_count += 1
+            self._pages[page] = _Page(position, records)
+            self._advance()
+            return page
+
+    def acknowledge(
+        self,
+        page: int,
+        records: int = 1,
+        completed: int = 0,
+        unchanged: int = 0,
+        failed_id: str | None = None,
+    ) -> None:
+        """Acknowledge records of a page: completed were loaded, unchanged were
+        skipped, and failed_id (if given) failed to load."""
+        with self._lock:
+            entry = self._pages[page]
+            entry.remaining -= records
+            entry.completed += completed
+            entry.unchanged += unchanged
+            if failed_id is not None:
+                entry.failed_ids.append(failed_id)
+            self._advance()
+
+    def _advance(self) -> None:
+        # Pages are numbered in order, and dicts keep insertion order.
+        while self._pages:
+            page, entry = next(iter(self._pages.items()))
+            if entry.remaining > 0:
+                break
+            del self._pages[page]
+            self.position = entry.position
+            self.completed += entry.completed
+            self.unchanged += entry.unchanged
+            self.errors += len(entry.failed_ids)
+            self.failed_ids.extend(entry.failed_ids)
+        if time.monotonic() - self._saved >= self.SAVE_INTERVAL:
+            self._save()
+
+    def save(self) -> None:
+        with self._lock:
+            self._save()
+
+    def _save(self) -> None:
+        state = {
+            **self.run,
+            "position": self.position,
+            "completed": self.completed,
+            "errors": self.errors,
+            "unchanged": self.unchanged,
+            "failed_ids": self.failed_ids,
+            "updated": format_timestamp(datetime.now(timezone.utc)),
+        }
+        save_state(self.index_name, state, self.suffix)
+        self._saved = time.monotonic()
+
+
+class DeadLetters:
+    """Documents which Elasticsearch failed to load, with the error and the
+    source record's id fields, appended to a gzipped NDJSON file for
+    retry_failed. Each worker of a copy has its own file.
+
+    Can be shared by threads.
+    """
+
+    # Number of failures to collect before writing them.
+    BUFFER_SIZE = 100
+
+    def __init__(self, index_name: str, partition: tuple[int, int] | None = None):
+        self.path = state_file(
+            index_name, f".failed{partition_suffix(partition)}.ndjson.gz"
+        )
+        self._buffer: list[dict] = []
+        self._lock = threading.Lock()
+
+    def add(self, doc_id: str, source_id: dict, error: dict, doc: dict) -> None:
+        with self._lock:
+            self._buffer.append(
+                {"id": doc_id, "source_id": source_id, "error": error, "doc": doc}
+            )
+            if len(self._buffer) >= self.BUFFER_SIZE:
+                self._flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._buffer:
+            return
+        # Each write adds a separate gzip member, so a crash can only lose
+        # failures not yet written.
+        with gzip.open(self.path, "at", encoding="utf-8") as f:
+            for dead_letter in self._buffer:
+                f.write(json.dumps(dead_letter, ensure_ascii=False, default=str))
+                f.write("\n")
+        self._buffer = []
+
+
+def load_dead_letters(index_name: str) -> dict[str, dict]:
+    """Load the failed documents of all copies into index_name, by id;
+    the latest failure of each document."""
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    dead_letters = {}
+    for path in sorted(STATE_DIR.glob(f"{index_name}.failed*.ndjson.gz")):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                dead_letter = json.loads(line)
+                dead_letters[dead_letter["id"]] = dead_letter
+    return dead_letters
+
+
+def delete_dead_letters(index_name: str) -> None:
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    for path in STATE_DIR.glob(f"{index_name}.failed*.ndjson.gz"):
+        path.unlink()
@@ -0,0 +1,184 @@
+"""Explicit Elasticsearch mappings and index templates, derived from profiles.
+
+Without one, Elasticsearch maps every string field a profile emits as text
+with a keyword subfield. For profiles which copy all source fields (e.g.
+config.samvera) that is hundreds of fields, most of which are never searched.
+index_template maps each field a profile can emit (from the profile, plus a
+field census for those which copy all fields) by what it holds:
+
+keyword: ids and URLs, and Solr string fields (*_ssi, *_ssim, *_sim),
+    which are only matched exactly or aggregated; very long values are
+    kept in _source but not indexed.
+display: fields only shown, never searched (*_ssm, *_ss, thumbnails),
+    kept in _source but not indexed.
+text, date, long, boolean: other Solr fields, by their dynamic field suffix.
+names, titles, subjects: the fields shared by all sources, analyzed with
+    shared analyzers, keeping the keyword subfield dynamic mapping gives them.
+
+Anything else is mapped as Elasticsearch would dynamically. Solr fields not in
+the census are mapped by their suffix with dynamic templates. Profiles can set
+the kind of any output field with INDEX_FIELDS, e.g. {"content": "text"}.
+"""
+
+from fnmatch import fnmatch
+from types import ModuleType
+from typing import Iterable
+
+ANALYSIS = {
+    "char_filter": {
+        # Subdivisions of Library of Congress subjects: Music--20th century.
+        "subject_separators": {
+            "type": "pattern_replace",
+            "pattern": "--",
+            "replacement": " ",
+        }
+    },
+    "filter": {
+        "english_possessive": {"type": "stemmer", "language": "possessive_english"}
+    },
+    "analyzer": {
+        "names": {
+            "type": "custom",
+            "tokenizer": "standard",
+            "filter": ["lowercase", "asciifolding"],
+        },
+        "titles": {
+            "type": "custom",
+            "tokenizer": "standard",
+            "filter": ["english_possessive", "lowercase", "asciifolding"],
+        },
+        "subjects": {
+            "type": "custom",
+            "char_filter": ["subject_separators"],
+            "tokenizer": "standard",
+            "filter": ["lowercase", "asciifolding"],
+        },
+    },
+}
+
+# Keyword subfield, as added by dynamic mapping, for sorting and aggregations.
+_KEYWORD_SUBFIELD = {"keyword": {"type": "keyword", "ignore_above": 256}}
+# Longer keyword values aren't indexed (but are kept in _source), rather than
+# failing the whole document: a term can be at most 32766 bytes, and a
+# character at most 4 bytes in UTF-8. Long ids and URLs are still searchable.
+_KEYWORD_LIMIT = 8191
+FIELD_KINDS = {
+    "keyword": {"type": "keyword", "ignore_above": _KEYWORD_LIMIT},
+    "display": {"type": "keyword", "index": False, "doc_values": False},
+    "text": {"type": "text"},
+    "date": {"type": "date"},
+    "long": {"type": "long"},
+    "boolean": {"type": "boolean"},
+    "names": {"type": "text", "analyzer": "names", "fields": _KEYWORD_SUBFIELD},
+    "titles": {"type": "text", "analyzer": "titles", "fields": _KEYWORD_SUBFIELD},
+    "subjects": {
+        "type": "text",
+        "analyzer": "subjects",
+        "fields": _KEYWORD_SUBFIELD,
+    },
+}
+
+# Kinds of the output fields shared by all sources.
+SHARED_FIELDS = {
+    "id": "keyword",
+    "url": "keyword",
+    "ark": "keyword",
+    "names": "names",
+    "titles": "titles",
+    "subjects": "subjects",
+    "subject_topics": "subjects",
+    "named_subjects": "subjects",
+}
+# Kinds of Solr dynamic fields (as in Hyrax and Blacklight), by pattern.
+SOLR_FIELDS = {
+    "*_tesim": "text",
+    "*_tesi": "text",
+    "*_tim": "text",
+    "*_ssim": "keyword",
+    "*_ssi": "keyword",
+    "*_sim": "keyword",
+    "*_ssm": "display",
+    "*_ss": "display",
+    "*_dtsim": "date",
+    "*_dtsi": "date",
+    "*_dtsort": "date",
+    "*_isim": "long",
+    "*_isi": "long",
+    "*_lts": "long",
+    "*_bsi": "boolean",
+}
+# Kinds of other output fields, by pattern; the first match is used.
+NAMED_FIELDS = {
+    "thumbnail*": "display",
+    "*_url": "keyword",
+    "*_id": "keyword",
+}
+
+
+def _match(field: str, patterns: dict[str, str]) -> str | None:
+    return next(
+        (kind for pattern, kind in patterns.items() if fnmatch(field, pattern)), None
+    )
+
+
+def field_kinds(
+    profile_module: ModuleType, source_fields: Iterable[str] = ()
+) -> dict[str, str]:
+    """Get the kind (see FIELD_KINDS) of each field a profile's documents
+    can have, given the fields of source records; fields which would be mapped
+    as Elasticsearch does dynamically are left out."""
+    mapper = profile_module.map_record
+    overrides = getattr(profile_module, "INDEX_FIELDS", {})
+    # Fields combined into names, e.g. creators, are names too.
+    names = set(mapper.profile.get("concat", {}).get("names", ()))
+
+    kinds = {}
+    for field in mapper.output_fields(source_fields):
+        kind = (
+            overrides.get(field)
+            or SHARED_FIELDS.get(field)
+            or ("names" if field in names else None)
+            or _match(field, SOLR_FIELDS)
+            or _match(field, NAMED_FIELDS)
+        )
+        if kind:
+            kinds[field] = kind
+    return kinds
+
+
+def index_template(
+    profile_module: ModuleType, index: str, source_fields: Iterable[str] = ()
+) -> dict:
+    """Make an index template for a profile's documents, for index and its
+    versions (index-*), with explicit mappings for the fields the profile
+    can emit given the fields of source records (see field_kinds)."""
+    source_fields = list(source_fields)
+    unknown = set(getattr(profile_module, "INDEX_FIELDS", {}).values()) - set(
+        FIELD_KINDS
+    )
+    if unknown:
+        raise ValueError(f"Unknown INDEX_FIELDS kinds: {sorted(unknown)}")
+    if profile_module.map_record.profile.get("keep_all") and not source_fields:
+        raise ValueError(
+            f"{profile_module.__name__} copies all source fields, "
+            "so it needs a field census"
+        )
+    properties = {
+        field: FIELD_KINDS[kind]
+        for field, kind in sorted(field_kinds(profile_module, source_fields).items())
+    }
+    dynamic_templates = [
+        {f"solr{pattern[1:]}": {"match": pattern, "mapping": FIELD_KINDS[kind]}}
+        for pattern, kind in SOLR_FIELDS.items()
+    ]
+    return {
+        "index_patterns": [index, f"{index}-*"],
+        "template": {
+            "settings": {"analysis": ANALYSIS},
+            "mappings": {
+                "dynamic_templates": dynamic_templates,
+                "properties": properties,
+            },
+        },
+        "_meta": {"profile": profile_module.__name__},
+    }